@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import schema
+
+
+# The lookups the services run on their hot paths
+LOOKUPS = {
+    'duplicate_check': """
+        SELECT 1
+        FROM cars
+        WHERE segment_id = ? AND segment_name = ? AND model_type = ? AND car_name = ? AND year = ?
+    """,
+    'image_lookup': """
+        SELECT car_id, segment_id, segment_name, model_type, image_data, front_view, back_view, left_side_view, right_side_view
+        FROM cars
+        WHERE model_type = ? AND segment_id = ?
+    """,
+}
+
+SEGMENTS = 5000
+MODEL_TYPES = ('hatchback', 'sedan', 'suv', 'coupe', 'convertible', 'pickup', 'van', 'wagon')
+
+
+def populate(conn, rows, batch=50000):
+    """Fill cars with rows synthetic vehicles spread over SEGMENTS segments."""
+    rng = random.Random(0)
+    cursor = conn.cursor()
+    for start in range(0, rows, batch):
+        cursor.executemany("""
+            INSERT INTO cars (car_name, segment_id, segment_name, model_type, year, engine_type, fuel_type, price,
+                              image_data, front_view, back_view, left_side_view, right_side_view)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (f"car-{i}", i % SEGMENTS, f"segment-{i}", rng.choice(MODEL_TYPES), 2000 + i % 25, "petrol", "gasoline", 10000.0,
+             *(f"https://res.cloudinary.com/demo/image/upload/{i}_{view}.jpg" for view in range(5)))
+            for i in range(start, min(rows, start + batch))
+        ])
+    conn.commit()
+    cursor.close()
+
+
+def probes(rows, count):
+    """Parameters for count lookups of each kind against a table of rows vehicles."""
+    rng = random.Random(1)
+    duplicate = []
+    for _ in range(count):
+        i = rng.randrange(rows)
+        duplicate.append((i % SEGMENTS, f"segment-{i}", rng.choice(MODEL_TYPES), f"car-{i}", 2000 + i % 25))
+    image = [(rng.choice(MODEL_TYPES), rng.randrange(SEGMENTS)) for _ in range(count)]
+    return {'duplicate_check': duplicate, 'image_lookup': image}
+
+
+def drop_unique_segment(conn):
+    """Rebuild the (still empty) cars table without unique_segment, as migration 4 does.
+
+    Its autoindex would otherwise serve duplicate_check in the unindexed baseline.
+    """
+    statements = next(statements for version, _, statements in schema.MIGRATIONS if version == 4)["sqlite"]
+    rename = next(i for i, statement in enumerate(statements) if "RENAME TO cars" in statement)
+    cursor = conn.cursor()
+    for statement in statements[:rename + 1]:
+        cursor.execute(statement)
+    conn.commit()
+    cursor.close()
+
+
+def time_lookups(conn, params):
+    """Run every probe and return per-lookup latency percentiles in milliseconds."""
+    cursor = conn.cursor()
+    report = {}
+    for name, query in LOOKUPS.items():
+        latencies = []
+        for args in params[name]:
+            started = time.perf_counter()
+            cursor.execute(query, args)
+            cursor.fetchall()
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        report[name] = {
+            'p50_ms': round(statistics.median(latencies), 4),
+            'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 4),
+            'max_ms': round(latencies[-1], 4),
+        }
+    cursor.close()
+    return report
+
+
+def run(sizes, count):
+    """Benchmark both lookups before (migrations 1-2, no unique_segment) and after all migrations for each table size."""
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            path = os.path.join(directory, f"cars_{rows}.sqlite3")
+            conn = sqlite3.connect(path)
+            schema.migrate(conn, "sqlite", target_version=2)  # tables only, no secondary indexes
+            drop_unique_segment(conn)
+            populate(conn, rows)
+            params = probes(rows, count)
+
+            entry = {'rows': rows, 'unindexed': time_lookups(conn, params)}
+            started = time.perf_counter()
+            schema.migrate(conn, "sqlite")
+            entry['index_build_seconds'] = round(time.perf_counter() - started, 2)
+            entry['indexed'] = time_lookups(conn, params)
+            conn.close()
+
+            print(json.dumps(entry), flush=True)
+            results.append(entry)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure catalog lookup latency as the cars table grows, with and without indexes.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--lookups", type=int, default=200, help="probes per lookup kind and size")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.lookups)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,328 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+RESOLUTIONS = ("640x480", "1280x960", "2048x1536")
+WORKLOADS = ("detect", "upload_car", "upload_images", "upload_images_batch")
+VIEWS = ("image_data", "front_view", "back_view", "left_side_view", "right_side_view")
+
+
+def synthetic_vehicle(width, height, seed):
+    """A deterministic vehicle-like photo: sky/road gradient, body, windows, wheels and sensor noise."""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    image[:] = np.linspace(200, 90, height, dtype=np.uint8)[:, None, None]
+
+    color = tuple(int(c) for c in rng.integers(40, 220, size=3))
+    body = (int(width * 0.1), int(height * 0.45), int(width * 0.9), int(height * 0.75))
+    cv2.rectangle(image, body[:2], body[2:], color, -1)
+    cv2.rectangle(image, (int(width * 0.25), int(height * 0.3)), (int(width * 0.7), int(height * 0.45)), color, -1)
+    cv2.rectangle(image, (int(width * 0.3), int(height * 0.33)), (int(width * 0.65), int(height * 0.44)), (60, 60, 70), -1)
+    for x in (0.25, 0.75):
+        cv2.circle(image, (int(width * x), int(height * 0.75)), int(height * 0.08), (20, 20, 20), -1)
+
+    noise = rng.normal(0, 2, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def add_scratches(image, count, seed):
+    """Copy of image with count thin light scratches drawn across the body panel."""
+    import cv2
+
+    rng = random.Random(seed)
+    scratched = image.copy()
+    height, width = image.shape[:2]
+    for _ in range(count):
+        x0, y0 = rng.randint(int(width * 0.15), int(width * 0.85)), rng.randint(int(height * 0.5), int(height * 0.7))
+        x1, y1 = x0 + rng.randint(-width // 5, width // 5), y0 + rng.randint(-height // 20, height // 20)
+        cv2.line(scratched, (x0, y0), (x1, y1), (235, 235, 235), rng.choice((1, 2)))
+    return scratched
+
+
+class FakeCDNHandler(SimpleHTTPRequestHandler):
+    """Serves a FakeCloudinary directory at /image/upload/[<transformation>/]v<version>/<public_id>.
+
+    Scale (c_scale,w_,h_), e_grayscale and f_ transformations are rendered with OpenCV
+    the way Cloudinary would render a derivative.
+    """
+
+    UPLOAD_PATH = re.compile(r"^/image/upload/(?:(?P<transformation>[^/]*_[^/]*)/)?v\d+/(?P<public_id>[^/?#]+)")
+
+    def do_GET(self):
+        match = self.UPLOAD_PATH.match(self.path)
+        if match is None:
+            return super().do_GET()
+        if not match['transformation']:
+            self.path = f"/{match['public_id']}"
+            return super().do_GET()
+
+        import cv2
+        image = cv2.imread(os.path.join(self.directory, match['public_id']))
+        if image is None:
+            return self.send_error(404)
+        params = dict(part.split("_", 1) for part in match['transformation'].split(","))
+        if 'w' in params and 'h' in params:
+            image = cv2.resize(image, (int(params['w']), int(params['h'])), interpolation=cv2.INTER_AREA)
+        if params.get('e') == "grayscale":
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        fmt = params.get('f', "jpg")
+        _, data = cv2.imencode(f".{fmt}", image)
+        self.send_response(200)
+        self.send_header("Content-Type", f"image/{'jpeg' if fmt == 'jpg' else fmt}")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data.tobytes())
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(directory):
+    """Serve directory over HTTP on a free local port; stands in for the Cloudinary CDN."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(FakeCDNHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_workload(workload, resolution, iterations, warmup, cars_per_segment, batch_vehicles, compare_workers):
+    """Run one workload in this process and return its measurements; called in a fresh child process."""
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    # Every cache and side file lives in the scratch directory
+    os.environ.update({
+        "REFERENCE_CACHE_DIR": os.path.join(workdir, "reference_cache"),
+        "REFERENCE_STORE_DIR": os.path.join(workdir, "reference_store"),
+        "UPLOAD_CACHE_PATH": os.path.join(workdir, "upload_cache.sqlite3"),
+        "JOBS_DB_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "DIAGNOSTICS_DIR": os.path.join(workdir, "diagnostics"),
+        "COMPARE_WORKERS": str(compare_workers),
+    })
+
+    import cv2
+
+    import catalog
+    import compare_pool
+    import config
+    import db_pool
+    import service
+    import uploads
+
+    width, height = (int(v) for v in resolution.split("x"))
+    images_dir = os.path.join(workdir, "images")
+    cdn_dir = os.path.join(workdir, "cdn")
+    os.makedirs(images_dir)
+    os.makedirs(cdn_dir)
+    server, base_url = serve_directory(cdn_dir)
+    uploads.set_backend(uploads.FakeCloudinary(cdn_dir, base_url=base_url))
+    uploads.set_cache(None)  # every iteration really uploads
+    pool = db_pool.sqlite_pool(os.path.join(workdir, "catalog.sqlite3"))
+    db_config = config.settings.db_config
+    db_pool.set_pool(db_config, pool)  # every blueprint shares this database
+
+    def photo_pair(key):
+        """Write a clean reference to the CDN and a scratched retake to disk; return (new_path, reference_url)."""
+        seed = zlib.crc32(key.encode())
+        clean = synthetic_vehicle(width, height, seed)
+        cv2.imwrite(os.path.join(cdn_dir, f"{key}.jpg"), clean)
+        new_path = os.path.join(images_dir, f"{key}.jpg")
+        cv2.imwrite(new_path, add_scratches(clean, 6, seed))
+        return new_path, f"{base_url}/image/upload/v1/{key}.jpg"
+
+    def seed_segment(segment_id):
+        """Create cars_per_segment cars in segment_id pointing at clean references; return new image paths."""
+        image_paths = {}
+        reference_urls = {}
+        for view in VIEWS:
+            image_paths[view], reference_urls[view] = photo_pair(f"s{segment_id}_{view}")
+        with db_pool.get_pool(db_config).connection() as conn:
+            cursor = conn.cursor()
+            for car in range(cars_per_segment):
+                details = {
+                    'car_name': f"car-{segment_id}-{car}", 'segment_id': segment_id, 'segment_name': f"segment-{segment_id}",
+                    'model_type': "sedan", 'year': 2022, 'engine_type': "petrol", 'fuel_type': "gasoline", 'price': 10000.0,
+                }
+                catalog.upsert(cursor, "sqlite", catalog.CARS, catalog.row_values(catalog.CARS, details, reference_urls))
+            conn.commit()
+            cursor.close()
+        return image_paths
+
+    def expect_ok(response):
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    total = warmup + iterations
+    if workload == "upload_car":
+        # Mounting the blueprint creates the schema
+        client = service.create_app(['kj']).test_client()
+        calls = []
+        for i in range(total):
+            image_paths = {view: photo_pair(f"car{i}_{view}")[0] for view in VIEWS}
+            payload = {
+                'car_name': f"bench-{i}", 'segment_id': i, 'segment_name': f"segment-{i}", 'model_type': "sedan",
+                'year': 2022, 'engine_type': "petrol", 'fuel_type': "gasoline", 'price': 10000.0, 'image_paths': image_paths,
+            }
+            calls.append(lambda payload=payload: expect_ok(client.post("/upload_car", json=payload)))
+    else:
+        client = service.create_app(['kj', 'scratch']).test_client()
+        import scratch
+        calls = []
+        for i in range(total):
+            if workload == "detect":
+                new_path, reference_url = photo_pair(f"detect{i}")
+                calls.append(lambda new_path=new_path, url=reference_url: scratch.inspector.detect_scratches_or_differences(new_path, url))
+            elif workload == "upload_images":
+                payload = {'segment_id': i, 'model_type': "sedan", 'image_paths': seed_segment(i)}
+                calls.append(lambda payload=payload: expect_ok(client.post("/cars/upload-images", json=payload)))
+            else:
+                vehicles = [
+                    {'segment_id': i * batch_vehicles + k, 'model_type': "sedan",
+                     'image_paths': seed_segment(i * batch_vehicles + k)}
+                    for k in range(batch_vehicles)
+                ]
+                calls.append(lambda vehicles=vehicles: expect_ok(client.post("/cars/upload-images/batch", json={'vehicles': vehicles})))
+
+    logging.getLogger().setLevel(logging.WARNING)  # the services log every image at INFO
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for i, call in enumerate(calls):
+        if i == warmup:
+            started = time.perf_counter()
+        call_started = time.perf_counter()
+        try:
+            call()
+        except Exception as e:
+            errors += 1
+            logging.error(f"{workload} iteration {i} failed: {e}")
+        if i >= warmup:
+            latencies.append((time.perf_counter() - call_started) * 1000)
+    elapsed = time.perf_counter() - started
+
+    if workload != "upload_car":
+        compare_pool.default_pool().shutdown()  # reap the workers so their peak RSS is reported
+    server.shutdown()
+
+    latencies.sort()
+    return {
+        'workload': workload,
+        'resolution': resolution,
+        'iterations': iterations,
+        'errors': errors,
+        'throughput_per_second': round(iterations / elapsed, 3) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(latencies[-1], 3),
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_worker_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(baseline, current):
+    """Print p95 and throughput of current relative to baseline for every shared workload/resolution."""
+    before = {(r['workload'], r['resolution']): r for r in baseline['results']}
+    for result in current['results']:
+        old = before.get((result['workload'], result['resolution']))
+        if old is None:
+            continue
+        print(f"{result['workload']:>20} {result['resolution']:>10}  "
+              f"p95 {old['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms ({result['p95_ms'] / old['p95_ms']:.2f}x)  "
+              f"throughput {old['throughput_per_second']} -> {result['throughput_per_second']}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scratch detection and the upload endpoints on synthetic images.")
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), help="WIDTHxHEIGHT of the synthetic photos")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--cars-per-segment", type=int, default=10)
+    parser.add_argument("--batch-vehicles", type=int, default=8)
+    parser.add_argument("--compare-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="results file; defaults to bench_results_<commit>.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--run-one", nargs=2, metavar=("WORKLOAD", "RESOLUTION"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    settings = {
+        'iterations': args.iterations,
+        'warmup': args.warmup,
+        'cars_per_segment': args.cars_per_segment,
+        'batch_vehicles': args.batch_vehicles,
+        'compare_workers': args.compare_workers,
+    }
+
+    if args.run_one:
+        result = run_workload(*args.run_one, **settings)
+        print(json.dumps(result))
+        return 0
+
+    # Each workload runs in its own process so caches start cold and peak RSS is its own
+    results = []
+    for workload in args.workloads:
+        for resolution in args.resolutions:
+            command = [sys.executable, os.path.abspath(__file__), "--run-one", workload, resolution]
+            for name, value in settings.items():
+                command += [f"--{name.replace('_', '-')}", str(value)]
+            child = subprocess.run(command, capture_output=True, text=True)
+            if child.returncode != 0:
+                print(f"{workload} {resolution} failed:\n{child.stderr[-2000:]}", file=sys.stderr)
+                continue
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            print(json.dumps(result), flush=True)
+            results.append(result)
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'created_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': settings,
+        'results': results,
+    }
+    output = args.output or f"bench_results_{(commit or 'unknown')[:8]}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare_reports(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import metrics
+import schema
+
+
+# What each catalog table stores. id is the identity column, key is the natural key,
+# backed by a unique index (migration 4); the image columns are optional and hold
+# hosted image URLs. A segment holds one scooter per model type.
+CARS = {
+    'table': 'cars',
+    'id': 'car_id',
+    'fields': ('car_name', 'segment_id', 'segment_name', 'model_type', 'year', 'engine_type', 'fuel_type', 'price'),
+    'key': ('segment_id', 'segment_name', 'model_type', 'car_name', 'year'),
+}
+
+SCOOTERS = {
+    'table': 'scooter_ev',
+    'id': 'scooter_id',
+    'fields': ('scooter_name', 'segment_id', 'segment_name', 'model_type', 'year', 'motor_type', 'battery_type', 'price'),
+    'key': ('model_type', 'segment_id'),
+}
+
+TABLES = {'cars': CARS, 'scooters': SCOOTERS}
+
+
+def columns(spec):
+    """Every insertable column of the table, in the order row values are given."""
+    return spec['fields'] + schema.IMAGE_COLUMNS
+
+
+def row_values(spec, details, image_urls):
+    """Build the row values for spec from a dict of field values and a {column: url} dict."""
+    return [details[field] for field in spec['fields']] + [image_urls.get(column) for column in schema.IMAGE_COLUMNS]
+
+
+def key_of(spec, values):
+    """The natural key of a row given as row values."""
+    return tuple(values[spec['fields'].index(field)] for field in spec['key'])
+
+
+def insert_statement(spec):
+    names = columns(spec)
+    return f"""
+        INSERT INTO {spec['table']} ({', '.join(names)})
+        VALUES ({', '.join('?' * len(names))})
+    """
+
+
+def upsert_statement(spec, dialect):
+    """Single-statement insert that does nothing when a row with the same natural key exists.
+
+    On SQL Server the existence check takes UPDLOCK/HOLDLOCK on the key range, so two
+    concurrent uploads of the same vehicle cannot both insert; SQLite relies on the
+    unique index through ON CONFLICT DO NOTHING.
+    """
+    names = columns(spec)
+    if dialect == "sqlite":
+        return insert_statement(spec) + f" ON CONFLICT ({', '.join(spec['key'])}) DO NOTHING"
+    return f"""
+        INSERT INTO {spec['table']} ({', '.join(names)})
+        SELECT {', '.join('?' * len(names))}
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {spec['table']} WITH (UPDLOCK, HOLDLOCK)
+            WHERE {' AND '.join(f'{field} = ?' for field in spec['key'])}
+        )
+    """
+
+
+def upsert(cursor, dialect, spec, values):
+    """Insert one row unless its natural key already exists; return True if a row was inserted.
+
+    The caller commits.
+    """
+    params = list(values)
+    if dialect != "sqlite":
+        params += list(key_of(spec, values))
+    with metrics.stage('db_insert'):
+        cursor.execute(upsert_statement(spec, dialect), params)
+    return cursor.rowcount == 1
@@ -0,0 +1,243 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import metrics
+
+
+# Comparison pool settings using Environment Variables; 0 workers runs comparisons in-process
+COMPARE_WORKERS = int(os.getenv("COMPARE_WORKERS", str(os.cpu_count() or 1)))
+COMPARE_MAX_PENDING = int(os.getenv("COMPARE_MAX_PENDING", str(max(1, COMPARE_WORKERS) * 4)))
+COMPARE_SUBMIT_TIMEOUT = float(os.getenv("COMPARE_SUBMIT_TIMEOUT", "5"))
+
+
+class PoolSaturated(Exception):
+    """Raised when every comparison slot stays busy for longer than COMPARE_SUBMIT_TIMEOUT."""
+
+
+def _warm_worker():
+    """Import OpenCV and run one tiny comparison so the first real request pays no start-up cost."""
+    import cv2
+    import numpy as np
+    import scratch_pipeline
+    cv2.setNumThreads(1)  # one process per core already; avoid oversubscribing
+    blank = np.zeros((16, 16), dtype=np.uint8)
+    scratch_pipeline.compare(blank, blank, scratch_pipeline.CAR_PROFILE)
+
+
+def _compare(op, new_images, reference_images, profile, capture_stages=False, signatures=None):
+    """Run one comparison and return (result, {stage: seconds}) so the parent can record the timings."""
+    import scratch_pipeline
+    timings = {}
+    if op == "batch":
+        return scratch_pipeline.compare_batch(new_images, reference_images, profile, timings=timings), timings
+    if not capture_stages:
+        outcome = scratch_pipeline.compare_tiered(new_images, reference_images, profile, timings=timings, signatures=signatures)
+        return outcome, timings
+
+    stages = {}
+
+    def keep_stage(stage, image):
+        stages[stage] = image.copy()
+    outcome = scratch_pipeline.compare_tiered(new_images, reference_images, profile, debug_writer=keep_stage, timings=timings,
+                                              signatures=signatures)
+    return (outcome, stages), timings
+
+
+def _deliver(result, timed_result):
+    """Record the worker's stage timings and pass the comparison result on to result."""
+    value, timings = timed_result
+    metrics.observe_stages(timings)
+    result.set_result(value)
+
+
+def _settle(result, done):
+    """Pass the outcome of the Future done on to the Future result."""
+    try:
+        result.set_result(done.result())
+    except BaseException as e:
+        result.set_exception(e)
+
+
+def _run_shared(name, shape, op, profile, capture_stages=False, signatures=None):
+    """Worker entry point: view the two stacked image blocks in shared memory and compare them."""
+    import numpy as np
+    # Attaching registers the segment with the resource tracker inherited from the parent
+    # (started before the fork in ComparePool), so the parent's unlink unregisters it and
+    # a worker dying mid-task cannot remove a segment the parent still owns
+    shm = shared_memory.SharedMemory(name=name)
+    images = np.ndarray((2,) + shape, dtype=np.uint8, buffer=shm.buf)
+    try:
+        return _compare(op, images[0], images[1], profile, capture_stages, signatures)
+    finally:
+        del images
+        try:
+            shm.close()
+        except BufferError:
+            pass  # a view is still referenced by a traceback; the mapping goes when it is collected
+
+
+class ComparePool:
+    """Process pool running the OpenCV comparison off the request thread.
+
+    Images travel through a shared-memory segment rather than being pickled, and at
+    most max_pending comparisons may be queued or running; further callers wait up
+    to submit_timeout for a slot and then get PoolSaturated. When a worker dies (OOM
+    kill, a crash inside OpenCV) the executor is broken for good, so it is replaced
+    and the comparisons it lost are submitted once more.
+    """
+
+    def __init__(self, workers=COMPARE_WORKERS, max_pending=COMPARE_MAX_PENDING, submit_timeout=COMPARE_SUBMIT_TIMEOUT):
+        self.workers = workers
+        self.submit_timeout = submit_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        if workers > 0:
+            self._executor = self._new_executor()
+
+    def _new_executor(self):
+        # fork before any OpenCV work happens in the parent; spawn would re-import the Flask app
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        # Start the resource tracker first so forked workers share it instead of each
+        # starting their own, which would unlink in-flight segments when a worker exits
+        resource_tracker.ensure_running()
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_warm_worker)
+
+    def _replace(self, broken):
+        """Swap in a fresh executor for broken, unless another caller already has."""
+        with self._executor_lock:
+            if self._executor is not broken:
+                return
+            logging.warning("A comparison worker died; restarting the comparison pool.")
+            self._executor = self._new_executor()
+        broken.shutdown(wait=False)
+
+    def warm(self):
+        """Start every worker process now instead of on the first request."""
+        if self._executor is None:
+            return
+        futures = [self._executor.submit(os.getpid) for _ in range(self.workers)]
+        pids = {future.result() for future in futures}
+        logging.info(f"Comparison pool ready with {len(pids)} worker processes.")
+
+    def _submit(self, op, new_images, reference_images, profile, capture_stages=False, signatures=None, retry=True):
+        """Queue one comparison and return a Future; the slot and shared memory are freed when it completes.
+
+        With retry, a comparison lost to a broken executor is submitted once more to
+        its replacement; a second loss is passed on as BrokenProcessPool.
+        """
+        if not self._slots.acquire(timeout=self.submit_timeout):
+            raise PoolSaturated(f"All {self.workers} comparison workers are busy")
+
+        result = Future()
+        if self._executor is None:
+            try:
+                _deliver(result, _compare(op, new_images, reference_images, profile, capture_stages, signatures))
+            except Exception as e:
+                result.set_exception(e)
+            finally:
+                self._slots.release()
+            return result
+
+        import numpy as np
+        shm = None
+        executor = self._executor
+        try:
+            new_images = np.ascontiguousarray(new_images, dtype=np.uint8)
+            shm = shared_memory.SharedMemory(create=True, size=2 * new_images.nbytes)
+            block = np.ndarray((2,) + new_images.shape, dtype=np.uint8, buffer=shm.buf)
+            block[0] = new_images
+            block[1] = reference_images
+            del block
+            future = executor.submit(_run_shared, shm.name, new_images.shape, op, profile, capture_stages, signatures)
+        except BaseException as e:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            self._slots.release()
+            if isinstance(e, BrokenProcessPool) and retry:
+                self._replace(executor)
+                return self._submit(op, new_images, reference_images, profile, capture_stages, signatures, retry=False)
+            raise
+
+        def resubmit():
+            self._replace(executor)
+            try:
+                again = self._submit(op, new_images, reference_images, profile, capture_stages, signatures, retry=False)
+            except BaseException as e:
+                result.set_exception(e)
+                return
+            again.add_done_callback(lambda done: _settle(result, done))
+
+        def cleanup(done):
+            # The slot and the caller's Future must be settled even if freeing the segment fails
+            try:
+                shm.close()
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+            finally:
+                self._slots.release()
+                if retry and not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+                    resubmit()
+                    return
+                try:
+                    _deliver(result, done.result())
+                except BaseException as e:
+                    result.set_exception(e)
+        future.add_done_callback(cleanup)
+        return result
+
+    def compare(self, new_prepared, reference_prepared, profile, capture_stages=False, signatures=None):
+        """Run scratch_pipeline.compare_tiered in a worker process and return its outcome dict.
+
+        signatures, the pair's signatures from before enhancement, are passed on for
+        the signature and tiled tiers. With capture_stages the result is (outcome,
+        {stage: image}) so the caller can hand the intermediate images to
+        diagnostics; stages is empty when the signature tier settled the pair.
+        """
+        return self._submit("single", new_prepared, reference_prepared, profile, capture_stages, signatures).result()
+
+    def submit_batch(self, new_stack, reference_stack, profile):
+        """Queue scratch_pipeline.compare_batch in a worker process and return its Future."""
+        return self._submit("batch", new_stack, reference_stack, profile)
+
+    def shutdown(self):
+        with self._executor_lock:
+            executor = self._executor
+        if executor is not None:
+            executor.shutdown()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+_started = False
+
+
+def default_pool():
+    """Return the process-wide comparison pool, creating it on first use."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ComparePool()
+        return _default_pool
+
+
+def start():
+    """Create and warm the process-wide pool; only the first call does any work.
+
+    Workers import OpenCV themselves, so the parent can warm the pool without it.
+    """
+    global _started
+    pool = default_pool()
+    with _default_pool_lock:
+        if _started:
+            return
+        _started = True
+    pool.warm()
@@ -0,0 +1,37 @@
+import os
+
+
+class Config:
+    """Settings shared by every blueprint of the vehicle service, read from Environment Variables."""
+
+    def __init__(self, environ=os.environ):
+        # Database configuration
+        self.db_config = {
+            'server': environ.get('DB_SERVER'),
+            'database': environ.get('DB_DATABASE'),
+            'user': environ.get('DB_USER'),
+            'password': environ.get('DB_PASSWORD'),
+        }
+
+        # Cloudinary configuration
+        self.cloudinary = {
+            'cloud_name': environ.get('CLOUDINARY_CLOUD_NAME'),
+            'api_key': environ.get('CLOUDINARY_API_KEY'),
+            'api_secret': environ.get('CLOUDINARY_API_SECRET'),
+        }
+
+        # Which blueprint modules to mount; e.g. "kj,scooter,listings" for a catalog-only worker
+        # that never loads OpenCV
+        self.blueprints = [name.strip() for name in environ.get('SERVICE_BLUEPRINTS', 'kj,scooter,listings,scratch,scratchscooter').split(',') if name.strip()]
+
+        self.host = environ.get('HOST', '0.0.0.0')
+        self.port = int(environ.get('PORT', '5000'))
+        self.debug = environ.get('FLASK_DEBUG', '0') == '1'
+
+    def configure_cloudinary(self):
+        """Point the process-wide cloudinary.config() at these credentials."""
+        import cloudinary
+        cloudinary.config(**self.cloudinary)
+
+
+settings = Config()
@@ -0,0 +1,231 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Pool settings using Environment Variables
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+POOL_MAX_IDLE_SECONDS = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300"))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "30"))
+
+
+# Callables notified with the seconds every successful checkout took (e.g. metrics)
+checkout_observers = []
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+def build_connection_string(db_config):
+    """Build the ODBC connection string for the SQL Server described by db_config."""
+    return (
+        f"Driver={{ODBC Driver 18 for SQL Server}};"
+        f"Server={db_config['server']};"
+        f"Database={db_config['database']};"
+        f"UID={db_config['user']};"
+        f"PWD={db_config['password']};"
+    )
+
+
+class ConnectionPool:
+    """Bounded pool of DB-API connections with checkout health checks and idle eviction."""
+
+    def __init__(self, connect, max_size=POOL_MAX_SIZE, max_idle_seconds=POOL_MAX_IDLE_SECONDS,
+                 checkout_timeout=POOL_CHECKOUT_TIMEOUT, dialect="mssql"):
+        self._connect = connect
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.checkout_timeout = checkout_timeout
+        self.dialect = dialect
+
+        self._lock = threading.Condition()
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._size = 0
+        self._in_use = 0
+
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._checkout_seconds_total = 0.0
+        self._checkout_seconds_max = 0.0
+
+    def _evict_idle(self):
+        """Close idle connections that have not been used for max_idle_seconds (lock held)."""
+        cutoff = time.monotonic() - self.max_idle_seconds
+        stale = [conn for conn, last_used in self._idle if last_used < cutoff]
+        if not stale:
+            return
+        self._idle = [(conn, last_used) for conn, last_used in self._idle if last_used >= cutoff]
+        self._size -= len(stale)
+        self._discarded += len(stale)
+        for conn in stale:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logging.warning(f"Error closing pooled connection: {e}")
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception as e:
+            logging.warning(f"Discarding unhealthy pooled connection: {e}")
+            return False
+
+    def acquire(self):
+        """Check a healthy connection out of the pool, opening a new one if there is room."""
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+
+        while True:
+            conn = None
+            with self._lock:
+                self._evict_idle()
+                waited = False
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"No database connection available after {self.checkout_timeout}s")
+                    if not waited:
+                        self._waits += 1
+                        waited = True
+                    self._lock.wait(remaining)
+                    self._evict_idle()
+
+                if self._idle:
+                    conn, _ = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self._created += 1
+            elif not self._is_healthy(conn):
+                self._close_quietly(conn)
+                with self._lock:
+                    self._size -= 1
+                    self._discarded += 1
+                    self._lock.notify()
+                continue
+
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._in_use += 1
+                self._checkouts += 1
+                self._checkout_seconds_total += elapsed
+                self._checkout_seconds_max = max(self._checkout_seconds_max, elapsed)
+            for observe in checkout_observers:
+                observe(elapsed)
+            return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any open transaction first."""
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception as e:
+                logging.warning(f"Rollback failed on pooled connection, discarding it: {e}")
+                discard = True
+
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+        if discard:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and always gives it back."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def metrics(self):
+        """Return a snapshot of pool usage counters."""
+        with self._lock:
+            return {
+                'size': self._size,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'discarded': self._discarded,
+                'checkout_latency_avg_ms': (self._checkout_seconds_total / self._checkouts * 1000) if self._checkouts else 0.0,
+                'checkout_latency_max_ms': self._checkout_seconds_max * 1000,
+            }
+
+    def close(self):
+        """Close every idle connection currently held by the pool."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_config):
+    """Return the process-wide pool for db_config, creating it on first use."""
+    conn_str = build_connection_string(db_config)
+    with _pools_lock:
+        pool = _pools.get(conn_str)
+        if pool is None:
+            def connect():
+                import pyodbc
+                return pyodbc.connect(conn_str)
+            pool = ConnectionPool(connect)
+            _pools[conn_str] = pool
+        return pool
+
+
+def set_pool(db_config, pool):
+    """Install pool as the shared pool for db_config, e.g. a SQLite stand-in for local testing."""
+    conn_str = build_connection_string(db_config)
+    with _pools_lock:
+        previous = _pools.get(conn_str)
+        _pools[conn_str] = pool
+    if previous is not None and previous is not pool:
+        previous.close()
+
+
+def sqlite_pool(path, **kwargs):
+    """Create a pool backed by a local SQLite database with the same interface as SQL Server."""
+    def connect():
+        return sqlite3.connect(path, check_same_thread=False)
+    return ConnectionPool(connect, dialect="sqlite", **kwargs)
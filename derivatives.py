@@ -0,0 +1,47 @@
+import functools
+import os
+import re
+
+
+# Cloudinary derivative settings using Environment Variables. With REFERENCE_DERIVATIVES,
+# comparisons download a server-side downscaled grayscale derivative of each stored
+# image instead of the full-resolution original; EAGER_DERIVATIVES asks Cloudinary to
+# render it at upload time so the first inspection does not wait for it. It is off by
+# default: Cloudinary's resampling does not match the local decode of the new photo,
+# which moves the comparison thresholds, and profiles that normalise the difference
+# never use it (see reference_cache).
+REFERENCE_DERIVATIVES = os.getenv("REFERENCE_DERIVATIVES", "0") == "1"
+REFERENCE_DERIVATIVE_FORMAT = os.getenv("REFERENCE_DERIVATIVE_FORMAT", "jpg")  # jpg or webp
+EAGER_DERIVATIVES = os.getenv("EAGER_DERIVATIVES", "0") == "1"
+
+DERIVATIVE_SIZE = (500, 500)
+
+# https://<host>[/<cloud_name>]/image/upload/[v<version>/]<public_id>
+_UPLOAD_URL = re.compile(r"^(?P<base>https?://[^?#]+?/image/upload/)(?P<asset>[^?#]+)$")
+
+
+def transformation(size=DERIVATIVE_SIZE, fmt=REFERENCE_DERIVATIVE_FORMAT):
+    """Cloudinary transformation matching decode_reference: scale to size ignoring aspect ratio, then grayscale."""
+    width, height = size
+    return f"c_scale,w_{width},h_{height},e_grayscale,f_{fmt},q_auto:best"
+
+
+@functools.lru_cache(maxsize=65536)
+def derivative_url(url, size=DERIVATIVE_SIZE, fmt=REFERENCE_DERIVATIVE_FORMAT):
+    """The delivery URL of the comparison derivative of the stored image at url.
+
+    URLs that are not Cloudinary upload URLs are returned unchanged, as is every URL
+    when REFERENCE_DERIVATIVES is off. Results are cached per asset.
+    """
+    match = _UPLOAD_URL.match(url) if REFERENCE_DERIVATIVES and url else None
+    if match is None:
+        return url
+    return f"{match['base']}{transformation(size, fmt)}/{match['asset']}"
+
+
+def eager_options(size=DERIVATIVE_SIZE, fmt=REFERENCE_DERIVATIVE_FORMAT):
+    """Extra cloudinary.uploader.upload arguments registering the derivative eagerly, or {} when disabled."""
+    if not (EAGER_DERIVATIVES and REFERENCE_DERIVATIVES):
+        return {}
+    # The eager transformation must be the same string derivative_url puts in the URL
+    return {'eager': [{'raw_transformation': transformation(size, fmt)}], 'eager_async': True}
@@ -0,0 +1,92 @@
+import itertools
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+import cv2
+
+
+# Diagnostics settings using Environment Variables. Off by default; N > 0 captures
+# the intermediate images of one comparison in every N.
+DIAGNOSTICS_SAMPLE_EVERY = int(os.getenv("DIAGNOSTICS_SAMPLE_EVERY", "0"))
+DIAGNOSTICS_DIR = os.getenv("DIAGNOSTICS_DIR", "diagnostics")
+DIAGNOSTICS_MAX_BYTES = int(os.getenv("DIAGNOSTICS_MAX_BYTES", str(200 * 1024 * 1024)))
+DIAGNOSTICS_QUEUE_SIZE = int(os.getenv("DIAGNOSTICS_QUEUE_SIZE", "64"))
+
+_counter = itertools.count()
+_counter_lock = threading.Lock()
+_queue = queue.Queue(maxsize=DIAGNOSTICS_QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def should_capture():
+    """Return True for one comparison in every DIAGNOSTICS_SAMPLE_EVERY; always False when disabled."""
+    if DIAGNOSTICS_SAMPLE_EVERY <= 0:
+        return False
+    with _counter_lock:
+        return next(_counter) % DIAGNOSTICS_SAMPLE_EVERY == 0
+
+
+def record(tag, stages):
+    """Queue the stage images of one comparison to be written under their own directory.
+
+    Never blocks the caller: when the writer has fallen behind, the capture is dropped.
+    """
+    _ensure_writer()
+    try:
+        _queue.put_nowait((tag, stages))
+    except queue.Full:
+        logging.warning(f"Diagnostics queue full, dropping capture for {tag}.")
+
+
+def _ensure_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="diagnostics-writer", daemon=True)
+            _writer.start()
+
+
+def _write_loop():
+    while True:
+        tag, stages = _queue.get()
+        try:
+            directory = os.path.join(DIAGNOSTICS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}-{tag}")
+            os.makedirs(directory, exist_ok=True)
+            for stage, image in stages.items():
+                cv2.imwrite(os.path.join(directory, f"debug_{stage}.jpg"), image)
+            _enforce_cap()
+        except Exception as e:
+            logging.error(f"Error writing diagnostics for {tag}: {e}")
+
+
+def _directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _enforce_cap():
+    """Delete the oldest capture directories until DIAGNOSTICS_DIR fits DIAGNOSTICS_MAX_BYTES."""
+    captures = []
+    for name in os.listdir(DIAGNOSTICS_DIR):
+        path = os.path.join(DIAGNOSTICS_DIR, name)
+        if os.path.isdir(path):
+            captures.append((os.path.getmtime(path), path, _directory_size(path)))
+
+    total = sum(size for _, _, size in captures)
+    for _, path, size in sorted(captures):
+        if total <= DIAGNOSTICS_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+
+# Reference download settings using Environment Variables. All downloads share one
+# keep-alive connection pool, so rows of a segment reuse the same CDN connections
+# instead of paying a TCP and TLS handshake each.
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "32"))
+DOWNLOAD_MAX_KEEPALIVE = int(os.getenv("DOWNLOAD_MAX_KEEPALIVE", "16"))
+DOWNLOAD_CONNECT_TIMEOUT_SECONDS = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT_SECONDS", "5"))
+DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("DOWNLOAD_TIMEOUT_SECONDS", "30"))
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+PREFETCH_MAX_CONCURRENCY_PER_REQUEST = int(os.getenv("PREFETCH_MAX_CONCURRENCY_PER_REQUEST", "8"))
+PREFETCH_TIMEOUT_SECONDS = float(os.getenv("PREFETCH_TIMEOUT_SECONDS", "30"))
+
+
+class DownloadTooLarge(Exception):
+    """Raised when a response body is larger than DOWNLOAD_MAX_BYTES."""
+
+
+_client = None
+_client_lock = threading.Lock()
+_buffers = threading.local()
+_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_MAX_CONNECTIONS, thread_name_prefix="reference-download")
+
+
+def client():
+    """Return the process-wide httpx client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(
+                limits=httpx.Limits(max_connections=DOWNLOAD_MAX_CONNECTIONS, max_keepalive_connections=DOWNLOAD_MAX_KEEPALIVE),
+                timeout=httpx.Timeout(DOWNLOAD_TIMEOUT_SECONDS, connect=DOWNLOAD_CONNECT_TIMEOUT_SECONDS),
+                follow_redirects=True,
+            )
+        return _client
+
+
+def _buffer(size):
+    """This thread's download buffer, replaced by a larger one when size does not fit.
+
+    It is never resized in place, so a view handed out earlier stays valid (if
+    overwritten) rather than blocking the next download.
+    """
+    buffer = getattr(_buffers, 'data', None)
+    if buffer is None or len(buffer) < size:
+        buffer = bytearray(max(size, 2 * len(buffer) if buffer else 256 * 1024))
+        _buffers.data = buffer
+    return buffer
+
+
+def fetch(url, headers=None):
+    """GET url through the shared pool and return (status_code, body, headers).
+
+    body is None for a 304. Otherwise it is a memoryview over this thread's reusable
+    buffer, valid until the thread's next fetch, so decode or copy it straight away.
+    Other error statuses raise httpx.HTTPStatusError.
+    """
+    with client().stream("GET", url, headers=headers) as response:
+        if response.status_code == 304:
+            return 304, None, response.headers
+        response.raise_for_status()
+
+        expected = int(response.headers.get("Content-Length") or 0)
+        if expected > DOWNLOAD_MAX_BYTES:
+            raise DownloadTooLarge(f"{url} is {expected} bytes, more than {DOWNLOAD_MAX_BYTES}")
+        buffer = _buffer(expected)
+        size = 0
+        for chunk in response.iter_bytes():
+            end = size + len(chunk)
+            if end > DOWNLOAD_MAX_BYTES:
+                raise DownloadTooLarge(f"{url} is more than {DOWNLOAD_MAX_BYTES} bytes")
+            if end > len(buffer):
+                grown = _buffer(end)
+                grown[:size] = buffer[:size]
+                buffer = grown
+            buffer[size:end] = chunk
+            size = end
+        return response.status_code, memoryview(buffer)[:size], response.headers
+
+
+def submit(load, *args):
+    """Call load(*args) on the download threads without waiting for it; failures are logged."""
+    def log_failure(future):
+        if future.exception() is not None:
+            logging.warning(f"Background download failed: {future.exception()}")
+    future = _executor.submit(load, *args)
+    future.add_done_callback(log_failure)
+    return future
+
+
+def prefetch(load, keys, max_concurrency=PREFETCH_MAX_CONCURRENCY_PER_REQUEST, timeout=PREFETCH_TIMEOUT_SECONDS):
+    """Call load(key) for every key on the download threads, at most max_concurrency at a time.
+
+    Returns once all calls finished or timeout seconds have passed; calls still running
+    then carry on in the background and keys not yet started are skipped, so the
+    caller simply loads those itself. Failures are logged, not raised. Returns the
+    number of keys loaded.
+    """
+    deadline = time.monotonic() + timeout
+    pending = list(keys)
+    in_flight = {}
+    loaded = 0
+
+    while pending or in_flight:
+        while pending and len(in_flight) < max_concurrency:
+            key = pending.pop(0)
+            in_flight[_executor.submit(load, key)] = key
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logging.warning(f"Prefetch stopped after {timeout}s with {len(in_flight) + len(pending)} downloads unfinished.")
+            break
+        done, _ = wait(in_flight, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            key = in_flight.pop(future)
+            try:
+                future.result()
+                loaded += 1
+            except Exception as e:
+                logging.warning(f"Prefetch of {key} failed: {e}")
+    return loaded
@@ -0,0 +1,149 @@
+import contextvars
+import hashlib
+import io
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+
+class DecodeMemory:
+    """Bytes held by the full-size decoded frames of one request, and the most held at once."""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, nbytes):
+        with self._lock:
+            self.current += nbytes
+            self.peak = max(self.peak, self.current)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.current -= nbytes
+
+
+_decode_memory = contextvars.ContextVar('decode_memory', default=None)
+
+
+def track_decode_memory():
+    """Start counting decode memory for the current request and return its DecodeMemory."""
+    memory = DecodeMemory()
+    _decode_memory.set(memory)
+    return memory
+
+
+def decode_memory():
+    """The current request's DecodeMemory, or None outside a tracked request."""
+    return _decode_memory.get()
+
+
+class ImageBuffer:
+    """An incoming image held in memory for the length of one request.
+
+    Stands in for an image path throughout the pipeline. The encoded bytes are read
+    once and reused for hashing and upload; the decoded and resized frame, its
+    signature and the enhanced frame are computed once per comparison profile, when
+    first needed, and shared by every row it is compared against. str() gives the
+    file name for log lines and responses.
+    """
+
+    def __init__(self, filename, data, digest=None):
+        self.filename = filename or "upload"
+        self.data = data
+        self.digest = digest or hashlib.sha256(data).hexdigest()
+        self._gray = {}
+        self._signatures = {}
+        self._prepared = {}
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return self.filename
+
+    def imdecode(self, flags):
+        """cv2.imdecode of the buffer; None if it is not an image."""
+        import cv2
+        import numpy as np
+        return cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), flags)
+
+    def _decoded(self, profile):
+        """The decoded, resized grayscale frame for this profile; call with the lock held."""
+        if profile['name'] not in self._gray:
+            import scratch_pipeline  # OpenCV is only needed once something is compared
+            timings = {}
+            self._gray[profile['name']] = scratch_pipeline.decode_new_image(self, profile, timings, decode_memory())
+            metrics.observe_stages(timings)
+        return self._gray[profile['name']]
+
+    def signature(self, profile):
+        """scratch_pipeline.signature of the frame before enhancement, or None if it is not an image."""
+        with self._lock:
+            if profile['name'] not in self._signatures:
+                import scratch_pipeline
+                gray = self._decoded(profile)
+                self._signatures[profile['name']] = None if gray is None else scratch_pipeline.signature(gray)
+            return self._signatures[profile['name']]
+
+    def prepared(self, profile):
+        """The frame scratch_pipeline compares for this profile, decoded and prepared on first use.
+
+        The array is read-only because every comparison in the request shares it.
+        """
+        with self._lock:
+            if profile['name'] not in self._prepared:
+                import scratch_pipeline
+                gray = self._decoded(profile)
+                frame = None
+                if gray is not None:
+                    timings = {}
+                    frame = scratch_pipeline.prepare(gray, profile, timings)
+                    metrics.observe_stages(timings)
+                    frame.flags.writeable = False
+                self._prepared[profile['name']] = frame
+            return self._prepared[profile['name']]
+
+    def open(self):
+        """A fresh file object over the buffer, for upload backends that read files."""
+        stream = io.BytesIO(self.data)
+        stream.name = self.filename
+        return stream
+
+
+def read_file(image_path):
+    """Load the file at image_path into an ImageBuffer, or return None if it cannot be read."""
+    try:
+        with open(image_path, "rb") as f:
+            return ImageBuffer(image_path, f.read())
+    except OSError as e:
+        logging.warning(f"Could not read image {image_path}: {e}")
+        return None
+
+
+def load_images(image_paths, loaded=None):
+    """Replace the paths in a {column: image_path} dict with ImageBuffers, reading each file once.
+
+    loaded maps path -> ImageBuffer and may be shared between calls of one request so a
+    photo used by several vehicles is still read once. Paths that cannot be read are
+    kept as they are, so the usual file-not-found handling reports them.
+    """
+    loaded = {} if loaded is None else loaded
+    images = {}
+    for column, image_path in image_paths.items():
+        if isinstance(image_path, ImageBuffer):
+            images[column] = image_path
+            continue
+        if image_path not in loaded:
+            loaded[image_path] = read_file(image_path) if os.path.exists(image_path) else None
+        images[column] = loaded[image_path] or image_path
+    return images
+
+
+def image_exists(image):
+    """True for an in-memory image, or for a path that exists on disk."""
+    return isinstance(image, ImageBuffer) or os.path.exists(image)
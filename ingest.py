@@ -0,0 +1,231 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+
+import catalog
+import config
+import db_pool
+import metrics
+import response_cache
+import schema
+
+
+# Bulk ingest settings using Environment Variables. A chunk is validated, deduplicated
+# and inserted as one unit; 400 rows keeps the duplicate lookup under SQL Server's
+# 2100 parameter limit.
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "400"))
+
+INTEGER_FIELDS = ('segment_id', 'year')
+
+
+def read_rows(lines, fmt):
+    """Yield (line_number, row dict) from an iterable of text lines in 'ndjson' or 'csv' format.
+
+    A line that cannot be parsed is yielded as (line_number, None) so it is reported
+    as invalid instead of aborting the whole ingest.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def validate(row, spec):
+    """Return (values, None) for a valid row, in spec['fields'] + IMAGE_COLUMNS order, or (None, error)."""
+    if row is None:
+        return None, "Unparseable row"
+
+    values = []
+    for field in spec['fields']:
+        value = row.get(field)
+        if value is None or str(value).strip() == "":
+            return None, f"Missing required field: {field}"
+        try:
+            if field in INTEGER_FIELDS:
+                value = int(value)
+            elif field == 'price':
+                value = float(value)
+            else:
+                value = str(value).strip()
+        except ValueError:
+            return None, f"Invalid value for {field}: {value!r}"
+        values.append(value)
+
+    for column in schema.IMAGE_COLUMNS:
+        values.append(row.get(column) or None)
+    return values, None
+
+
+def existing_keys_statement(spec, dialect, count):
+    """Query joining count natural keys, given as a VALUES list, against the table.
+
+    The keys are returned as they were passed in, so the match follows the table's
+    collation (case-insensitive on SQL Server) like the unique index does.
+    """
+    names = ', '.join(spec['key'])
+    rows = ', '.join([f"({', '.join('?' * len(spec['key']))})"] * count)
+    on = ' AND '.join(f"t.{field} = chunk.{field}" for field in spec['key'])
+    if dialect == "sqlite":
+        return f"""
+            WITH chunk ({names}) AS (VALUES {rows})
+            SELECT DISTINCT {', '.join(f'chunk.{field}' for field in spec['key'])}
+            FROM chunk JOIN {spec['table']} t ON {on}
+        """
+    return f"""
+        SELECT DISTINCT {', '.join(f'chunk.{field}' for field in spec['key'])}
+        FROM (VALUES {rows}) AS chunk ({names})
+        JOIN {spec['table']} t ON {on}
+    """
+
+
+def existing_keys(cursor, dialect, spec, keys):
+    """Return the subset of keys already present in the table, with one query for the whole chunk."""
+    keys = sorted(set(keys), key=repr)
+    if not keys:
+        return set()
+    with metrics.stage('db_query'):
+        cursor.execute(existing_keys_statement(spec, dialect, len(keys)), [value for key in keys for value in key])
+        return {tuple(row) for row in cursor.fetchall()}
+
+
+def insert_chunk(pool, spec, rows):
+    """Insert the validated rows that are not already stored and return (inserted, duplicates, errors).
+
+    The rows go in with one batched executemany (fast_executemany on SQL Server). If the
+    batch is rejected, e.g. because a concurrent upload inserted one of the vehicles
+    first, it is retried row by row with catalog.upsert so such rows count as
+    duplicates and only genuinely bad rows are reported.
+    """
+
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            found = existing_keys(cursor, pool.dialect, spec, [catalog.key_of(spec, values) for _, values in rows])
+
+            fresh = []
+            seen = set()
+            duplicates = 0
+            for line_number, values in rows:
+                key = catalog.key_of(spec, values)
+                if key in found or key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                fresh.append((line_number, values))
+
+            if not fresh:
+                return 0, duplicates, []
+
+            if pool.dialect == "mssql":
+                cursor.fast_executemany = True
+            try:
+                with metrics.stage('db_insert'):
+                    cursor.executemany(catalog.insert_statement(spec), [values for _, values in fresh])
+                conn.commit()
+                response_cache.invalidate(spec['table'], {values[spec['fields'].index('segment_id')] for _, values in fresh})
+                return len(fresh), duplicates, []
+            except Exception as e:
+                conn.rollback()
+                logging.warning(f"Batched insert into {spec['table']} rejected, retrying row by row: {e}")
+
+            inserted = 0
+            errors = []
+            for line_number, values in fresh:
+                try:
+                    if catalog.upsert(cursor, pool.dialect, spec, values):
+                        inserted += 1
+                    else:
+                        duplicates += 1
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    errors.append({'line': line_number, 'error': str(e)})
+            response_cache.invalidate(spec['table'], {values[spec['fields'].index('segment_id')] for _, values in fresh})
+            return inserted, duplicates, errors
+        finally:
+            cursor.close()
+
+
+def ingest(lines, fmt, spec, db_config, chunk_size=INGEST_CHUNK_SIZE):
+    """Bulk-load a catalog stream, yielding a progress dict after every chunk and a final summary.
+
+    Each progress dict carries the running totals (rows, inserted, duplicates, invalid)
+    and the per-line errors of that chunk.
+    """
+    schema.ensure_schema(db_config)
+    pool = db_pool.get_pool(db_config)
+    totals = {'rows': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0}
+
+    def flush(chunk, errors):
+        if chunk:
+            try:
+                inserted, duplicates, insert_errors = insert_chunk(pool, spec, chunk)
+            except Exception as e:
+                # A pool timeout or a failed lookup fails this chunk only; the
+                # progress stream carries on with the next one
+                logging.warning(f"Chunk insert into {spec['table']} failed: {e}")
+                inserted, duplicates, insert_errors = 0, 0, [{'line': line_number, 'error': str(e)} for line_number, _ in chunk]
+            totals['inserted'] += inserted
+            totals['duplicates'] += duplicates
+            totals['invalid'] += len(insert_errors)
+            errors = errors + insert_errors
+        return dict(totals, errors=errors)
+
+    chunk = []
+    errors = []
+    for line_number, row in read_rows(lines, fmt):
+        totals['rows'] += 1
+        values, error = validate(row, spec)
+        if error:
+            totals['invalid'] += 1
+            errors.append({'line': line_number, 'error': error})
+        else:
+            chunk.append((line_number, values))
+
+        if len(chunk) + len(errors) >= chunk_size:
+            yield flush(chunk, errors)
+            chunk, errors = [], []
+
+    if chunk or errors:
+        yield flush(chunk, errors)
+    logging.info(f"Ingested {totals['inserted']} of {totals['rows']} rows into {spec['table']}.")
+    yield dict(totals, done=True)
+
+
+def main(argv=None):
+    """Command-line bulk ingest: python ingest.py cars inventory.csv"""
+    parser = argparse.ArgumentParser(description="Bulk-load cars or scooters from an NDJSON or CSV file.")
+    parser.add_argument("table", choices=sorted(catalog.TABLES))
+    parser.add_argument("path", help="file to load, or - for standard input")
+    parser.add_argument("--format", choices=("ndjson", "csv"), help="defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('csv' if args.path.lower().endswith('.csv') else 'ndjson')
+
+    stream = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    try:
+        for progress in ingest(stream, fmt, catalog.TABLES[args.table], config.settings.db_config, args.chunk_size):
+            print(json.dumps(progress), flush=True)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import logging
+import os
+
+import numpy as np
+
+import compare_pool
+import reference_store
+import scratch_pipeline
+
+
+# Frames per vectorised comparison; bounds the memory of one stacked pass
+SCRATCH_BATCH_SIZE = int(os.getenv("SCRATCH_BATCH_SIZE", "64"))
+
+
+def detect_batch(pairs, profile, batch_size=SCRATCH_BATCH_SIZE):
+    """Detect scratches for many (new_image_path, existing_image_url, row_id, column) pairs at once.
+
+    Each distinct new image is loaded once, references come from the reference store,
+    and, when the profile has a signature_tolerance, pairs whose signatures match are
+    settled before anything is enhanced. The remaining prepared frames are compared
+    in stacked chunks with scratch_pipeline.compare_batch, spread over the
+    comparison process pool. Returns
+    one outcome dict per pair with the same failure semantics as the single-pair
+    detectors: an unreadable new image counts as no difference, an unreadable
+    reference as a difference.
+    """
+    # Every reference this batch needs is downloaded up front, several at a time
+    reference_store.prefetch([url for _, url, _, _ in pairs], profile)
+
+    detections = [None] * len(pairs)
+    new_images = {}
+    stacked = []  # (pair index, new frame, reference frame)
+
+    for i, (new_image_path, existing_image_url, row_id, column) in enumerate(pairs):
+        try:
+            if profile['signature_tolerance'] is not None:
+                settled = scratch_pipeline.settle_on_signatures((
+                    scratch_pipeline.load_new_signature(new_image_path, profile),
+                    reference_store.load_signature(existing_image_url, profile, row_id, column),
+                ), profile)
+                if settled is not None:
+                    detections[i] = settled
+                    continue
+
+            if new_image_path not in new_images:
+                new_images[new_image_path] = scratch_pipeline.load_new_image(new_image_path, profile)
+            new_image = new_images[new_image_path]
+            if new_image is None:
+                logging.error(f"Failed to load the new image: {new_image_path}")
+                detections[i] = scratch_pipeline.failed_outcome(False)
+                continue
+
+            reference = reference_store.load_reference(existing_image_url, profile, row_id, column)
+            if reference is None:
+                logging.error(f"Failed to load the existing image from Cloudinary: {existing_image_url}")
+                detections[i] = scratch_pipeline.failed_outcome(True)
+                continue
+        except scratch_pipeline.ImageTooLarge as e:
+            logging.error(f"Refusing to compare {new_image_path}: {e}")
+            detections[i] = scratch_pipeline.too_large_outcome()
+            continue
+        except Exception as e:
+            logging.error(f"Error preparing images for batch comparison: {e}")
+            detections[i] = scratch_pipeline.error_outcome()
+            continue
+        stacked.append((i, new_image, reference))
+
+    # Every chunk is queued at once so the comparison pool spreads them across its workers
+    pool = compare_pool.default_pool()
+    submitted = []
+    for start in range(0, len(stacked), batch_size):
+        chunk = stacked[start:start + batch_size]
+        future = pool.submit_batch(
+            np.stack([new_image for _, new_image, _ in chunk]),
+            np.stack([reference for _, _, reference in chunk]),
+            profile,
+        )
+        submitted.append((chunk, future))
+
+    for chunk, future in submitted:
+        try:
+            outcomes = future.result()
+        except Exception as e:
+            logging.error(f"Error detecting scratches in batch: {e}")
+            outcomes = [scratch_pipeline.error_outcome()] * len(chunk)
+        for (i, _, _), outcome in zip(chunk, outcomes):
+            detections[i] = outcome
+
+    logging.info(f"Compared {len(stacked)} image pairs in {(len(stacked) + batch_size - 1) // batch_size} batches.")
+    return detections
@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# Job queue settings using Environment Variables
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RETRY_DELAY_SECONDS = float(os.getenv("JOB_RETRY_DELAY_SECONDS", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """Background jobs persisted in SQLite and run by a bounded pool of worker threads.
+
+    handlers maps a job kind to a function called with the job's payload; its return
+    value is stored as the job result. Several queues, in one process or many, may
+    share the database: a worker claims a job by moving it from queued to running,
+    so each job runs once, and renews a lease on its running jobs every third of
+    lease_seconds. Running jobs whose lease has expired, because their process died,
+    are queued again. An exception listed in retry_on puts the job back in the queue
+    after JOB_RETRY_DELAY_SECONDS instead of failing it.
+    """
+
+    def __init__(self, handlers, path=JOBS_DB_PATH, workers=JOB_WORKERS, retry_on=(), lease_seconds=JOB_LEASE_SECONDS):
+        self.handlers = handlers
+        self.path = path
+        self.workers = workers
+        self.retry_on = tuple(retry_on)
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._pending = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                heartbeat_at REAL
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:  # databases created before leases existed
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status)")
+        self._conn.commit()
+
+    def start(self):
+        """Queue the waiting and abandoned jobs of the kinds this queue handles and start the worker threads."""
+        with self._start_lock:
+            if self._threads:
+                return
+            kinds = sorted(self.handlers)
+            self._requeue_expired()
+            with self._lock:
+                rows = self._conn.execute(f"""
+                    SELECT job_id FROM jobs
+                    WHERE status = ? AND kind IN ({', '.join('?' * len(kinds))})
+                    ORDER BY created_at
+                """, [QUEUED] + kinds).fetchall()
+            for (job_id,) in rows:
+                self._pending.put(job_id)
+            if rows:
+                logging.info(f"Resuming {len(rows)} unfinished jobs from {self.path}.")
+
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._renew_leases, name="job-lease", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _requeue_expired(self):
+        """Put running jobs of this queue's kinds whose lease has expired back in the queue; returns their ids."""
+        kinds = sorted(self.handlers)
+        expired_before = time.time() - self.lease_seconds
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT job_id FROM jobs
+                WHERE status = ? AND kind IN ({', '.join('?' * len(kinds))})
+                  AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+                ORDER BY created_at
+            """, [RUNNING] + kinds + [expired_before]).fetchall()
+            job_ids = [job_id for (job_id,) in rows]
+            for job_id in job_ids:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL WHERE job_id = ? AND status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                    (QUEUED, job_id, RUNNING, expired_before),
+                )
+            self._conn.commit()
+        if job_ids:
+            logging.warning(f"Requeued {len(job_ids)} jobs whose worker stopped renewing its lease.")
+        return job_ids
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                with self._lock:
+                    self._conn.execute(
+                        "UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND owner = ?",
+                        (time.time(), RUNNING, self.owner),
+                    )
+                    self._conn.commit()
+                for job_id in self._requeue_expired():
+                    self._pending.put(job_id)
+            except sqlite3.Error as e:
+                logging.warning(f"Could not renew job leases: {e}")
+
+    def submit(self, kind, payload):
+        """Persist a new job and queue it; returns the job id immediately."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self.start()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, kind, payload, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), QUEUED, time.time()),
+            )
+            self._conn.commit()
+        self._pending.put(job_id)
+        return job_id
+
+    def get(self, job_id):
+        """Return the job as a dict (status, result, error and timestamps), or None if unknown.
+
+        Only jobs of the kinds this queue handles are found, since several queues may share
+        one database. queue_position counts the queued jobs of those kinds submitted before
+        this one, plus one.
+        """
+        kinds = sorted(self.handlers)
+        with self._lock:
+            row = self._conn.execute(f"""
+                SELECT job_id, kind, status, result, error, attempts, created_at, started_at, finished_at
+                FROM jobs WHERE job_id = ? AND kind IN ({', '.join('?' * len(kinds))})
+            """, [job_id] + kinds).fetchone()
+            if row is None:
+                return None
+            job_id, kind, status, result, error, attempts, created_at, started_at, finished_at = row
+            queue_position = None
+            if status == QUEUED:
+                (ahead,) = self._conn.execute(f"""
+                    SELECT COUNT(*) FROM jobs
+                    WHERE status = ? AND kind IN ({', '.join('?' * len(kinds))})
+                      AND (created_at < ? OR (created_at = ? AND job_id < ?))
+                """, [QUEUED] + kinds + [created_at, created_at, job_id]).fetchone()
+                queue_position = ahead + 1
+        return {
+            'job_id': job_id,
+            'kind': kind,
+            'status': status,
+            'result': json.loads(result) if result is not None else None,
+            'error': error,
+            'attempts': attempts,
+            'created_at': created_at,
+            'started_at': started_at,
+            'finished_at': finished_at,
+            'queue_position': queue_position,
+        }
+
+    def _update(self, job_id, **fields):
+        """Update a job this queue has claimed; a no-op once its lease has passed to another worker."""
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE job_id = ? AND owner = ?",
+                list(fields.values()) + [job_id, self.owner],
+            )
+            self._conn.commit()
+
+    def _claim(self, job_id):
+        """Move a queued job to running under this queue's lease; returns (kind, payload), or None if it was not queued."""
+        now = time.time()
+        with self._lock:
+            claimed = self._conn.execute("""
+                UPDATE jobs SET status = ?, owner = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1
+                WHERE job_id = ? AND status = ?
+            """, (RUNNING, self.owner, now, now, job_id, QUEUED)).rowcount == 1
+            self._conn.commit()
+            if not claimed:
+                return None
+            return self._conn.execute("SELECT kind, payload FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+
+    def _work(self):
+        while True:
+            job_id = self._pending.get()
+            row = self._claim(job_id)
+            if row is None:
+                continue  # already claimed by another worker, or finished
+            kind, payload = row
+
+            try:
+                result = self.handlers[kind](json.loads(payload))
+            except self.retry_on as e:
+                logging.warning(f"Job {job_id} deferred: {e}")
+                self._update(job_id, status=QUEUED)
+                time.sleep(JOB_RETRY_DELAY_SECONDS)
+                self._pending.put(job_id)
+                continue
+            except Exception as e:
+                logging.error(f"Job {job_id} ({kind}) failed: {e}")
+                self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+                continue
+
+            self._update(job_id, status=DONE, result=json.dumps(result), finished_at=time.time())
+            logging.info(f"Job {job_id} ({kind}) finished.")
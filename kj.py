@@ -1,89 +1,58 @@
-import os
-import cloudinary
-import cloudinary.uploader
+import json
 import pyodbc
-from flask import Flask, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 
-app = Flask(__name__)
+import catalog
+import config
+import db_pool
+import image_context
+import ingest
+import response_cache
+import schema
+import spool
+import uploads
 
-# Cloudinary Configuration using Environment Variables
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET")
-)
+bp = Blueprint('cars', __name__)
 
-# Database configuration using Environment Variables
-db_config = {
-    'server': os.getenv('DB_SERVER'),
-    'database': os.getenv('DB_DATABASE'),
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-}
+# Database configuration shared by every blueprint (see config.py)
+db_config = config.settings.db_config
+
+@bp.record_once
+def bootstrap_schema(state):
+    # Create tables and indexes once at startup instead of on every request
+    schema.bootstrap(db_config)
 
 # Function to upload image to Cloudinary
 def upload_image_to_dam(image_path):
     """Upload image to Cloudinary and return the URL."""
     try:
-        response = cloudinary.uploader.upload(image_path)
-        return response.get("secure_url")
+        return uploads.upload_image(image_path)
     except Exception as e:
         print(f"Error uploading image: {e}")
         return None
 
-# Function to create the table (if it doesn't exist)
-def create_table(cursor):
-    cursor.execute("""
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='cars' AND xtype='U')
-        BEGIN
-            CREATE TABLE cars (
-                car_id INT PRIMARY KEY IDENTITY(1,1),
-                car_name NVARCHAR(255) NOT NULL,
-                segment_id INT NOT NULL,
-                segment_name NVARCHAR(255) NOT NULL,
-                model_type NVARCHAR(255),
-                year INT,
-                engine_type NVARCHAR(255),
-                fuel_type NVARCHAR(255),
-                price DECIMAL(10, 2),
-                image_data NVARCHAR(MAX),
-                front_view NVARCHAR(MAX),
-                back_view NVARCHAR(MAX),
-                left_side_view NVARCHAR(MAX),
-                right_side_view NVARCHAR(MAX),
-                CONSTRAINT unique_segment UNIQUE (segment_id, segment_name)
-            );
-        END;
-    """)
-    cursor.commit()
-
-def insert_car_details(car_name, segment_id, segment_name, model_type, year, engine_type, fuel_type, price, image_urls, cursor):
-    cursor.execute("""
-        SELECT 1 
-        FROM cars 
-        WHERE segment_id = ? AND segment_name = ? AND model_type = ? AND car_name = ? AND year = ?
-    """, (segment_id, segment_name, model_type, car_name, year))
-
-    if cursor.fetchone():
-        return "Car with the same details already exists in this segment."
+def insert_car_details(car_name, segment_id, segment_name, model_type, year, engine_type, fuel_type, price, image_urls, cursor, dialect="mssql"):
+    # One statement inserts the car unless its natural key already exists
+    details = {
+        'car_name': car_name, 'segment_id': segment_id, 'segment_name': segment_name, 'model_type': model_type,
+        'year': year, 'engine_type': engine_type, 'fuel_type': fuel_type, 'price': price,
+    }
+    inserted = catalog.upsert(cursor, dialect, catalog.CARS, catalog.row_values(catalog.CARS, details, image_urls))
+    cursor.connection.commit()
 
-    cursor.execute("""
-        INSERT INTO cars (car_name, segment_id, segment_name, model_type, year, engine_type, fuel_type, price,
-                          image_data, front_view, back_view, left_side_view, right_side_view)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        car_name, segment_id, segment_name, model_type, year, engine_type, fuel_type, price,
-        image_urls.get("image_data"), image_urls.get("front_view"),
-        image_urls.get("back_view"), image_urls.get("left_side_view"),
-        image_urls.get("right_side_view")
-    ))
-    cursor.commit()
+    if not inserted:
+        return "Car with the same details already exists in this segment."
+    response_cache.invalidate(catalog.CARS['table'], [segment_id])
     return "Car details inserted successfully."
 
 
-@app.route('/upload_car', methods=['POST'])
+@bp.route('/upload_car', methods=['POST'])
 def upload_car():
-    data = request.json
+    # JSON with server-side image paths, or multipart with one file part per image column
+    try:
+        data = spool.request_payload(request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     required_fields = ['car_name', 'segment_id', 'segment_name', 'model_type', 'year', 'engine_type', 'fuel_type', 'price', 'image_paths']
     for field in required_fields:
@@ -100,42 +69,46 @@ def upload_car():
     price = data['price']
     image_paths = data['image_paths']
 
-    image_urls = {}
-
-    for column, image_path in image_paths.items():
-        image_url = upload_image_to_dam(image_path)
-        if image_url:
-            image_urls[column] = image_url
-        else:
-            return jsonify({"error": f"Failed to upload image for {column}"}), 500
+    # Each file is read once and the same bytes are hashed and uploaded
+    image_urls, upload_errors = uploads.upload_many(image_context.load_images(image_paths), upload=upload_image_to_dam)
+    if upload_errors:
+        column = next(iter(upload_errors))
+        return jsonify({"error": f"Failed to upload image for {column}"}), 500
 
     try:
-        conn = pyodbc.connect(
-            f"Driver={{ODBC Driver 18 for SQL Server}};"
-            f"Server={db_config['server']};"
-            f"Database={db_config['database']};"
-            f"UID={db_config['user']};"
-            f"PWD={db_config['password']};"
-        )
-        cursor = conn.cursor()
-
-        create_table(cursor)
-        result = insert_car_details(car_name, segment_id, segment_name, model_type, year, engine_type, fuel_type, price, image_urls, cursor)
+        schema.ensure_schema(db_config)
+        pool = db_pool.get_pool(db_config)
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                result = insert_car_details(car_name, segment_id, segment_name, model_type, year, engine_type, fuel_type, price,
+                                            image_urls, cursor, pool.dialect)
+            finally:
+                cursor.close()
 
         if result == "Car with the same details already exists in this segment.":
-            return jsonify({"message": result}), 200
+            return jsonify({"message": result, "status": "duplicate"}), 200
 
-        return jsonify({"message": result}), 201
+        return jsonify({"message": result, "status": "inserted"}), 201
 
-    except pyodbc.Error as e:
+    except (pyodbc.Error, db_pool.PoolTimeout) as e:
         print(f"Database error: {e}")
         return jsonify({"error": "Database error occurred"}), 500
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+
+
+@bp.route('/upload_car/bulk', methods=['POST'])
+def upload_cars_bulk():
+    """Bulk-load vehicles from an NDJSON or CSV request body, streaming NDJSON progress back per chunk."""
+    fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    lines = (line.decode('utf-8') for line in request.stream)
+
+    def generate():
+        for progress in ingest.ingest(lines, fmt, catalog.CARS, db_config):
+            yield json.dumps(progress) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    import service
+    service.run(['kj'], {}, 'kj')
@@ -0,0 +1,154 @@
+import logging
+import os
+from decimal import Decimal
+
+import pyodbc
+from flask import Blueprint, current_app, jsonify, request, url_for
+
+import catalog
+import config
+import db_pool
+import metrics
+import response_cache
+import schema
+
+bp = Blueprint('listings', __name__)
+
+db_config = config.settings.db_config
+
+# Listing settings using Environment Variables
+LISTING_DEFAULT_LIMIT = int(os.getenv("LISTING_DEFAULT_LIMIT", "50"))
+LISTING_MAX_LIMIT = int(os.getenv("LISTING_MAX_LIMIT", "200"))
+
+# Query parameters each listing accepts: (parameter, column, operator, type)
+COMMON_FILTERS = (
+    ('segment_id', 'segment_id', '=', int),
+    ('model_type', 'model_type', '=', str),
+    ('year', 'year', '=', int),
+    ('min_price', 'price', '>=', float),
+    ('max_price', 'price', '<=', float),
+)
+FILTERS = {
+    'cars': COMMON_FILTERS + (('fuel_type', 'fuel_type', '=', str),),
+    'scooters': COMMON_FILTERS + (('battery_type', 'battery_type', '=', str),),
+}
+
+
+@bp.record_once
+def bootstrap_schema(state):
+    # Create tables and indexes once at startup instead of on every request
+    schema.bootstrap(db_config)
+
+
+def parse_query(kind, args):
+    """Return (filters, limit, after) from the query string; raises ValueError for bad values.
+
+    filters is a tuple of (parameter, column, operator, value) in FILTERS order, so it
+    doubles as part of the cache key.
+    """
+    filters = []
+    for parameter, column, operator, kind_of in FILTERS[kind]:
+        if parameter in args:
+            try:
+                filters.append((parameter, column, operator, kind_of(args[parameter])))
+            except ValueError:
+                raise ValueError(f"Invalid value for {parameter}: {args[parameter]!r}")
+
+    try:
+        limit = int(args.get('limit', LISTING_DEFAULT_LIMIT))
+        after = int(args['after']) if 'after' in args else None
+    except ValueError:
+        raise ValueError("limit and after must be integers")
+    if not 1 <= limit <= LISTING_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {LISTING_MAX_LIMIT}")
+    return tuple(filters), limit, after
+
+
+def listing_query(spec, filters, limit, after, dialect):
+    """SELECT for one page: rows after the id `after`, in id order, one more than limit.
+
+    Seeking on the identity column keeps every page an index range scan, however deep
+    the client has paged, where OFFSET would read and discard all earlier rows.
+    """
+    names = catalog.columns(spec)
+    conditions = [f"{column} {operator} ?" for _, column, operator, _ in filters]
+    params = [value for _, _, _, value in filters]
+    if after is not None:
+        conditions.append(f"{spec['id']} > ?")
+        params.append(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    if dialect == "sqlite":
+        query = f"SELECT {spec['id']}, {', '.join(names)} FROM {spec['table']} {where} ORDER BY {spec['id']} LIMIT ?"
+        return query, params + [limit + 1]
+    query = f"SELECT TOP (?) {spec['id']}, {', '.join(names)} FROM {spec['table']} {where} ORDER BY {spec['id']}"
+    return query, [limit + 1] + params
+
+
+def fetch_page(spec, filters, limit, after):
+    """Return (rows, next_after) for one page; next_after is None on the last page."""
+    pool = db_pool.get_pool(db_config)
+    query, params = listing_query(spec, filters, limit, after, pool.dialect)
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            with metrics.stage('db_query'):
+                cursor.execute(query, params)
+                results = cursor.fetchall()
+        finally:
+            cursor.close()
+
+    names = (spec['id'],) + catalog.columns(spec)
+    rows = [
+        {name: float(value) if isinstance(value, Decimal) else value for name, value in zip(names, row)}
+        for row in results[:limit]
+    ]
+    next_after = rows[-1][spec['id']] if len(results) > limit else None
+    return rows, next_after
+
+
+def list_vehicles(kind):
+    """One page of a listing as JSON, served from the response cache and honouring If-None-Match."""
+    spec = catalog.TABLES[kind]
+    try:
+        filters, limit, after = parse_query(kind, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    cache = response_cache.default_cache()
+    key = (kind, filters, limit, after)
+    cached = cache.get(key)
+    if cached is not None:
+        body, etag = cached
+    else:
+        generation = cache.generation(spec['table'])
+        try:
+            rows, next_after = fetch_page(spec, filters, limit, after)
+        except (pyodbc.Error, db_pool.PoolTimeout) as e:
+            logging.error(f"Error listing {kind}: {e}")
+            return jsonify({"error": "Database error occurred"}), 500
+
+        next_url = None
+        if next_after is not None:
+            next_url = url_for(request.endpoint, **dict(request.args.to_dict(), after=next_after))
+        page = {'items': rows, 'limit': limit, 'next_after': next_after, 'next': next_url}
+        body = current_app.json.dumps(page).encode('utf-8')
+        segment_id = next((value for parameter, _, _, value in filters if parameter == 'segment_id'), None)
+        etag = cache.put(key, body, spec['table'], segment_id, generation)
+
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # clients revalidate with If-None-Match
+    return response.make_conditional(request)
+
+
+@bp.route('/cars', methods=['GET'])
+def list_cars():
+    """List cars filtered by segment_id, model_type, fuel_type, year and min_price/max_price, paged with after=<car_id>."""
+    return list_vehicles('cars')
+
+
+@bp.route('/scooters', methods=['GET'])
+def list_scooters():
+    """List scooters filtered by segment_id, model_type, battery_type, year and min_price/max_price, paged with after=<scooter_id>."""
+    return list_vehicles('scooters')
@@ -0,0 +1,115 @@
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+import db_pool
+
+
+# Stage names: db_connect, db_query, db_insert, db_update, upload, reference_download,
+# decode, clahe, canny_contours. Buckets run from 1 ms to 30 s.
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    'vehicle_stage_seconds', 'Latency of one pipeline stage', ['stage'], buckets=STAGE_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    'vehicle_http_request_seconds', 'HTTP request latency', ['app', 'endpoint', 'method', 'status'], buckets=STAGE_BUCKETS,
+)
+IN_FLIGHT = Gauge(
+    'vehicle_http_requests_in_flight', 'HTTP requests currently being served', ['app', 'endpoint'],
+)
+DECODE_PEAK_BYTES = Histogram(
+    'vehicle_decode_peak_bytes', 'Most memory held by decoded incoming photos at once during one request',
+    ['app', 'endpoint'], buckets=tuple(2 ** power for power in range(20, 31)),  # 1 MiB to 1 GiB
+)
+SCRATCH_OUTCOMES = Counter(
+    'vehicle_scratch_outcomes_total', 'Image comparisons by outcome and the tier that decided them',
+    ['service', 'outcome', 'tier'],
+)
+
+
+class stage:
+    """Context manager timing one stage into STAGE_SECONDS: with metrics.stage('db_query'): ..."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.labels(self.name).observe(time.perf_counter() - self._started)
+        return False
+
+
+def observe_stages(timings):
+    """Record a {stage: seconds} dict, e.g. the timings scratch_pipeline collects in a worker process."""
+    for name, seconds in timings.items():
+        STAGE_SECONDS.labels(name).observe(seconds)
+
+
+def record_outcome(service, detection):
+    """Count one comparison outcome as error, scratch_detected or retained."""
+    if 'error' in detection:
+        outcome = 'error'
+    else:
+        outcome = 'scratch_detected' if detection['scratch_detected'] else 'retained'
+    SCRATCH_OUTCOMES.labels(service, outcome, detection.get('tier', 'unknown')).inc()
+
+
+class PoolCollector:
+    """Exports db_pool.ConnectionPool.metrics() for every shared pool at scrape time."""
+
+    def collect(self):
+        families = {}
+        with db_pool._pools_lock:
+            pools = list(db_pool._pools.values())
+        for index, pool in enumerate(pools):
+            for name, value in pool.metrics().items():
+                if name not in families:
+                    families[name] = GaugeMetricFamily(f'vehicle_db_pool_{name}', f'Connection pool {name}', labels=['pool'])
+                families[name].add_metric([str(index)], value)
+        return list(families.values())
+
+
+REGISTRY.register(PoolCollector())
+db_pool.checkout_observers.append(lambda seconds: STAGE_SECONDS.labels('db_connect').observe(seconds))
+
+
+def instrument(app, name):
+    """Track in-flight requests, latency and peak decode memory for every route of app and serve /metrics."""
+    from flask import Response, g, request
+
+    import image_context
+
+    def _endpoint():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    @app.before_request
+    def _start_request():
+        g.metrics_started = time.perf_counter()
+        g.metrics_endpoint = _endpoint()
+        g.decode_memory = image_context.track_decode_memory()
+        IN_FLIGHT.labels(name, g.metrics_endpoint).inc()
+
+    @app.after_request
+    def _record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_request(exc):
+        if 'metrics_started' not in g:
+            return
+        IN_FLIGHT.labels(name, g.metrics_endpoint).dec()
+        status = str(g.get('metrics_status', 500))
+        REQUEST_SECONDS.labels(name, g.metrics_endpoint, request.method, status).observe(time.perf_counter() - g.metrics_started)
+        if g.decode_memory.peak:
+            DECODE_PEAK_BYTES.labels(name, g.metrics_endpoint).observe(g.decode_memory.peak)
+
+    def metrics_endpoint():
+        return Response(generate_latest(REGISTRY), mimetype=CONTENT_TYPE_LATEST)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
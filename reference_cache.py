@@ -0,0 +1,267 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import httpx
+import numpy as np
+
+import derivatives
+import downloads
+import metrics
+import scratch_pipeline
+
+
+# Reference image cache settings using Environment Variables
+REFERENCE_CACHE_DIR = os.getenv("REFERENCE_CACHE_DIR", "reference_cache")
+REFERENCE_CACHE_MAX_MEMORY_BYTES = int(os.getenv("REFERENCE_CACHE_MAX_MEMORY_BYTES", str(256 * 1024 * 1024)))
+REFERENCE_CACHE_MAX_DISK_BYTES = int(os.getenv("REFERENCE_CACHE_MAX_DISK_BYTES", str(2 * 1024 * 1024 * 1024)))
+REFERENCE_CACHE_TTL_SECONDS = float(os.getenv("REFERENCE_CACHE_TTL_SECONDS", "3600"))
+
+REFERENCE_SIZE = (500, 500)
+
+
+def decode_reference(data, profile, size=REFERENCE_SIZE):
+    """Decode encoded image bytes to a grayscale image resized to size, or None if undecodable.
+
+    The steps are those of scratch_pipeline.decode_new_image for the same profile, so
+    a reference decodes exactly like the same photo uploaded again. Full-size
+    originals are decoded at a reduced scale when that still covers size.
+    """
+    try:
+        flags = scratch_pipeline.decode_flags(scratch_pipeline.image_dimensions(data), profile['decode_color'], size)
+    except scratch_pipeline.ImageTooLarge as e:
+        logging.error(f"Refusing to decode reference image: {e}")
+        return None
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    if image is None:
+        return None
+    return scratch_pipeline.to_gray(image, profile, size)
+
+
+class ReferenceImageCache:
+    """Two-level (memory, then disk) cache of decoded, resized grayscale reference images keyed by profile and URL.
+
+    Entries are served without any network traffic for ttl_seconds after they were
+    last fetched or validated; after that they are revalidated with If-None-Match /
+    If-Modified-Since and only re-downloaded when the server reports a change.
+    """
+
+    def __init__(self, directory=REFERENCE_CACHE_DIR, max_memory_bytes=REFERENCE_CACHE_MAX_MEMORY_BYTES,
+                 max_disk_bytes=REFERENCE_CACHE_MAX_DISK_BYTES, ttl_seconds=REFERENCE_CACHE_TTL_SECONDS,
+                 size=REFERENCE_SIZE):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (image, meta)
+        self._memory_bytes = 0
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'revalidated': 0,
+            'not_modified': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current memory usage."""
+        with self._lock:
+            return dict(self._counters, memory_bytes=self._memory_bytes, memory_entries=len(self._memory))
+
+    @staticmethod
+    def _key(url, profile):
+        return hashlib.sha256(f"{profile['name']}:{url}".encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".npy", base + ".json"
+
+    def _remember(self, key, image, meta):
+        """Insert into the in-memory LRU, evicting the least recently used entries beyond the byte budget."""
+        image.setflags(write=False)  # shared between requests
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= previous[0].nbytes
+            self._memory[key] = (image, meta)
+            self._memory_bytes += image.nbytes
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, (evicted, _) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.nbytes
+                self._counters['memory_evictions'] += 1
+
+    def _lookup_memory(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            return entry
+
+    def _load_disk(self, key):
+        image_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            image = np.load(image_path)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.warning(f"Ignoring unreadable reference cache entry {key}: {e}")
+            return None
+        os.utime(image_path)
+        return image, meta
+
+    def _store_disk(self, key, image, meta):
+        image_path, meta_path = self._paths(key)
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(image_path + tmp_suffix, "wb") as f:
+            np.save(f, image)
+        os.replace(image_path + tmp_suffix, image_path)
+        self._store_meta(key, meta)
+        self._evict_disk()
+
+    def _store_meta(self, key, meta):
+        _, meta_path = self._paths(key)
+        tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def _evict_disk(self):
+        """Delete the least recently used .npy entries until the directory fits max_disk_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            for stale in (path, path[:-len(".npy")] + ".json"):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            self._count('disk_evictions')
+
+    def _fetch(self, url, meta=None):
+        """GET url, conditionally when meta has validators. Returns (body or None if not modified, headers).
+
+        The body is a view over the download thread's reusable buffer; decode it before
+        this thread fetches again.
+        """
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers["If-None-Match"] = meta['etag']
+            if meta.get('last_modified'):
+                headers["If-Modified-Since"] = meta['last_modified']
+        with metrics.stage('reference_download'):
+            _, body, response_headers = downloads.fetch(url, headers)
+        return body, response_headers
+
+    def _download(self, url, profile, meta=None):
+        """_fetch the comparison derivative of url, or the original if the CDN will not serve the derivative.
+
+        Profiles that normalise the difference always get the original: min-max
+        normalisation stretches the CDN's resampling error into edges.
+        """
+        derived = url if profile['normalize'] else derivatives.derivative_url(url, self.size)
+        if derived != url:
+            try:
+                return self._fetch(derived, meta)
+            except httpx.HTTPStatusError as e:
+                logging.warning(f"Derivative of {url} unavailable, downloading the original: {e}")
+        return self._fetch(url, meta)
+
+    def get(self, url, profile):
+        """Return the 500x500 grayscale reference for url as decoded for profile, downloading it only when necessary."""
+        key = self._key(url, profile)
+
+        entry = self._lookup_memory(key)
+        if entry is not None:
+            self._count('memory_hits')
+        else:
+            entry = self._load_disk(key)
+            if entry is not None:
+                self._count('disk_hits')
+                self._remember(key, *entry)
+
+        if entry is not None:
+            image, meta = entry
+            if time.time() - meta['checked_at'] < self.ttl_seconds:
+                return image
+
+            self._count('revalidated')
+            try:
+                body, headers = self._download(url, profile, meta)
+            except Exception as e:
+                logging.warning(f"Revalidation of {url} failed, serving cached copy: {e}")
+                return image
+            if body is None:
+                self._count('not_modified')
+                meta = dict(meta, checked_at=time.time())
+                self._remember(key, image, meta)
+                self._store_meta(key, meta)
+                return image
+        else:
+            self._count('misses')
+            body, headers = self._download(url, profile)
+
+        with metrics.stage('decode'):
+            image = decode_reference(body, profile, self.size)
+        if image is None:
+            return None
+
+        meta = {
+            'url': url,
+            'profile': profile['name'],
+            'etag': headers.get("ETag"),
+            'last_modified': headers.get("Last-Modified"),
+            'checked_at': time.time(),
+        }
+        self._remember(key, image, meta)
+        self._store_disk(key, image, meta)
+        return image
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache():
+    """Return the process-wide reference image cache."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ReferenceImageCache()
+        return _default_cache
+
+
+def get_reference_image(url, profile):
+    """Fetch url through the process-wide cache; see ReferenceImageCache.get."""
+    return default_cache().get(url, profile)
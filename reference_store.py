@@ -0,0 +1,250 @@
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+import downloads
+import metrics
+import reference_cache
+import scratch_pipeline
+
+
+# Precomputed reference settings using Environment Variables
+REFERENCE_STORE_DIR = os.getenv("REFERENCE_STORE_DIR", "reference_store")
+REFERENCE_STORE_MAX_BYTES = int(os.getenv("REFERENCE_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+def url_digest(url):
+    """Hex digest naming the stored arrays of the image at url."""
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+class ReferenceStore:
+    """On-disk store of prepared reference images, memory-mapped on read.
+
+    Arrays are keyed by (profile, digest of the image URL) and written once, however
+    many rows point at that URL; the small signature of the frame before enhancement
+    (scratch_pipeline.signature) is kept next to each in SQLite. A SQLite index maps
+    each (profile, row id, column) to the digest it was last stored under, so an
+    array is deleted as soon as no indexed row uses it any more, and the least
+    recently read arrays are evicted once the directory holds more than max_bytes.
+    """
+
+    def __init__(self, directory=REFERENCE_STORE_DIR, max_bytes=REFERENCE_STORE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS reference_rows (
+                profile TEXT NOT NULL,
+                row_id TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (profile, row_id, column_name)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_reference_rows_digest ON reference_rows (profile, digest)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS reference_signatures (
+                profile TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                PRIMARY KEY (profile, digest)
+            )
+        """)
+        self._conn.commit()
+
+    def _path(self, profile_name, digest):
+        return os.path.join(self.directory, f"{profile_name}_{digest}.npy")
+
+    def contains(self, profile, url):
+        """True when the prepared reference for url is stored."""
+        return os.path.exists(self._path(profile['name'], url_digest(url)))
+
+    def get(self, profile, url):
+        """Return the memory-mapped prepared reference for url, or None."""
+        path = self._path(profile['name'], url_digest(url))
+        try:
+            prepared = np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable reference store entry for {profile['name']} {url}: {e}")
+            return None
+        try:
+            os.utime(path)  # recently read entries are evicted last
+        except FileNotFoundError:
+            pass  # evicted meanwhile; the mapping stays valid
+        return prepared
+
+    def get_signature(self, profile, url):
+        """Return the stored signature of the reference at url, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT signature FROM reference_signatures WHERE profile = ? AND digest = ?", (profile['name'], url_digest(url))
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).reshape(scratch_pipeline.SIGNATURE_SHAPE)
+
+    def put(self, profile, url, prepared, signature=None):
+        """Store prepared, and its signature when given, as the reference for url unless already stored."""
+        digest = url_digest(url)
+        if signature is not None:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO reference_signatures (profile, digest, signature) VALUES (?, ?, ?)",
+                    (profile['name'], digest, np.ascontiguousarray(signature, dtype=np.float32).tobytes()),
+                )
+                self._conn.commit()
+        path = self._path(profile['name'], digest)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(prepared))
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def assign(self, profile, row_ids, column, url):
+        """Index these rows' column as pointing at url and delete the arrays no indexed row uses any more."""
+        digest = url_digest(url)
+        keys = [(profile['name'], str(row_id), column) for row_id in row_ids]
+        with self._lock:
+            previous = {}
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT digest FROM reference_rows WHERE profile = ? AND row_id = ? AND column_name = ?", key
+                ).fetchone()
+                previous[key] = row[0] if row else None
+            changed = [key for key in keys if previous[key] != digest]
+            if not changed:
+                return
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO reference_rows (profile, row_id, column_name, digest) VALUES (?, ?, ?, ?)",
+                [key + (digest,) for key in changed],
+            )
+            orphans = [
+                old for old in {previous[key] for key in changed} - {None}
+                if self._conn.execute(
+                    "SELECT 1 FROM reference_rows WHERE profile = ? AND digest = ? LIMIT 1", (profile['name'], old)
+                ).fetchone() is None
+            ]
+            self._conn.commit()
+        for old in orphans:
+            self._remove(profile['name'], old)
+
+    def _remove(self, profile_name, digest):
+        """Delete the array and signature stored under digest."""
+        try:
+            os.remove(self._path(profile_name, digest))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._conn.execute("DELETE FROM reference_signatures WHERE profile = ? AND digest = ?", (profile_name, digest))
+            self._conn.commit()
+
+    def _evict(self):
+        """Delete the least recently read arrays until the directory fits max_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            profile_name, digest = os.path.basename(path)[:-len(".npy")].rsplit("_", 1)
+            self._remove(profile_name, digest)
+            total -= size
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_store():
+    """Return the process-wide reference store."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ReferenceStore()
+        return _default_store
+
+
+def load_reference(url, profile, row_id=None, column=None):
+    """Return the prepared reference for url from the store, preparing and storing it on a miss.
+
+    Each stored image is preprocessed once, however many rows use it; row_id and
+    column, when given, index the row against url.
+    """
+    store = default_store()
+    prepared = store.get(profile, url)
+    if prepared is not None:
+        return prepared
+
+    gray = reference_cache.get_reference_image(url, profile)
+    if gray is None:
+        return None
+    timings = {}
+    prepared = scratch_pipeline.prepare(gray, profile, timings)
+    metrics.observe_stages(timings)
+
+    store.put(profile, url, prepared, scratch_pipeline.signature(gray))
+    if row_id is not None:
+        store.assign(profile, [row_id], column, url)
+    return prepared
+
+
+def load_signature(url, profile, row_id=None, column=None):
+    """Return the signature of the reference at url, preparing and storing the reference first on a miss.
+
+    None when the reference cannot be loaded, or was stored without a signature.
+    """
+    store = default_store()
+    signature = store.get_signature(profile, url)
+    if signature is None and load_reference(url, profile, row_id, column) is not None:
+        signature = store.get_signature(profile, url)
+    return signature
+
+
+def store_new_reference(url, profile, row_ids, column):
+    """Index every row now pointing at a freshly uploaded url and prepare its reference in the background.
+
+    The reference is built by load_reference from the same CDN derivative a later
+    lazy fill would download, never from the uploaded original, so the stored array
+    does not depend on how the URL entered the store.
+    """
+    default_store().assign(profile, row_ids, column, url)
+    downloads.submit(load_reference, url, profile)
+
+
+def prefetch(urls, profile):
+    """Download, concurrently, the reference images for urls that the store does not hold yet.
+
+    Each URL is fetched once into the reference cache, so the load_reference calls
+    that follow only prepare and store them. Returns the number of URLs fetched.
+    """
+    store = default_store()
+    missing = []
+    for url in urls:
+        if url and url not in missing and not store.contains(profile, url):
+            missing.append(url)
+    if not missing:
+        return 0
+    return downloads.prefetch(functools.partial(reference_cache.get_reference_image, profile=profile), missing)
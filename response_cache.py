@@ -0,0 +1,96 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# Listing response cache settings using Environment Variables. The cache lives in one
+# process; writes made by other processes are only seen once RESPONSE_CACHE_TTL_SECONDS
+# has passed.
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+
+
+class ResponseCache:
+    """LRU of rendered response bodies with a TTL, invalidated per table and segment.
+
+    Every entry records the table it was read from and the segment_id it was filtered
+    on (None when it spans segments), so a write to one segment only drops the pages
+    that could contain it. A per-table generation, taken before the query and checked
+    on put, keeps a page read before a write from being cached after it.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (body, etag, stored_at, table, segment_id)
+        self._generations = {}
+        self._counters = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidated': 0, 'evictions': 0}
+
+    def stats(self):
+        """Return hit/miss/invalidation counters and the number of cached pages."""
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries))
+
+    def generation(self, table):
+        """Token to pass to put() for a page of table that is about to be read."""
+        with self._lock:
+            return self._generations.get(table, 0)
+
+    def get(self, key):
+        """Return (body, etag) for a fresh entry, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            body, etag, stored_at, _, _ = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self._counters['expired'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return body, etag
+
+    def put(self, key, body, table, segment_id, generation):
+        """Cache body unless table was written since generation was taken; return its ETag either way."""
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        with self._lock:
+            if self._generations.get(table, 0) != generation:
+                return etag
+            segment_id = None if segment_id is None else str(segment_id)  # JSON bodies send ids as int or str
+            self._entries[key] = (body, etag, time.monotonic(), table, segment_id)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+        return etag
+
+    def invalidate(self, table, segment_ids=None):
+        """Drop the cached pages of table that may include rows of segment_ids (all of them for None)."""
+        segment_ids = None if segment_ids is None else {str(segment_id) for segment_id in segment_ids}
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [
+                key for key, (_, _, _, entry_table, entry_segment) in self._entries.items()
+                if entry_table == table and (segment_ids is None or entry_segment is None or entry_segment in segment_ids)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self._counters['invalidated'] += len(stale)
+
+
+_default_cache = ResponseCache()
+
+
+def default_cache():
+    """Return the process-wide listing cache."""
+    return _default_cache
+
+
+def invalidate(table, segment_ids=None):
+    """Drop cached listing pages after a write to table; call once the write has committed."""
+    _default_cache.invalidate(table, segment_ids)
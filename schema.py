@@ -0,0 +1,288 @@
+import logging
+import threading
+import weakref
+
+import db_pool
+
+
+# Image columns shared by cars and scooter_ev. Column names are never taken from
+# request data directly; they are checked against this allowlist and the SQL is
+# built from these constants.
+IMAGE_COLUMNS = ('image_data', 'front_view', 'back_view', 'left_side_view', 'right_side_view')
+
+
+def image_columns(requested):
+    """Return the allowlisted image columns named in requested, in table order.
+
+    Raises ValueError for any name that is not an image column.
+    """
+    unknown = [column for column in requested if column not in IMAGE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown image column(s): {', '.join(map(str, unknown))}")
+    return [column for column in IMAGE_COLUMNS if column in requested]
+
+
+# Each migration is (version, name, {dialect: [statements]}). Versions only ever grow;
+# never edit a migration that has shipped, append a new one instead.
+MIGRATIONS = [
+    (1, "create_cars", {
+        "mssql": ["""
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='cars' AND xtype='U')
+            BEGIN
+                CREATE TABLE cars (
+                    car_id INT PRIMARY KEY IDENTITY(1,1),
+                    car_name NVARCHAR(255) NOT NULL,
+                    segment_id INT NOT NULL,
+                    segment_name NVARCHAR(255) NOT NULL,
+                    model_type NVARCHAR(255),
+                    year INT,
+                    engine_type NVARCHAR(255),
+                    fuel_type NVARCHAR(255),
+                    price DECIMAL(10, 2),
+                    image_data NVARCHAR(MAX),
+                    front_view NVARCHAR(MAX),
+                    back_view NVARCHAR(MAX),
+                    left_side_view NVARCHAR(MAX),
+                    right_side_view NVARCHAR(MAX),
+                    CONSTRAINT unique_segment UNIQUE (segment_id, segment_name)
+                );
+            END;
+        """],
+        "sqlite": ["""
+            CREATE TABLE IF NOT EXISTS cars (
+                car_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                car_name TEXT NOT NULL,
+                segment_id INTEGER NOT NULL,
+                segment_name TEXT NOT NULL,
+                model_type TEXT,
+                year INTEGER,
+                engine_type TEXT,
+                fuel_type TEXT,
+                price DECIMAL(10, 2),
+                image_data TEXT,
+                front_view TEXT,
+                back_view TEXT,
+                left_side_view TEXT,
+                right_side_view TEXT,
+                CONSTRAINT unique_segment UNIQUE (segment_id, segment_name)
+            )
+        """],
+    }),
+    (2, "create_scooter_ev", {
+        "mssql": ["""
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='scooter_ev' AND xtype='U')
+            BEGIN
+                CREATE TABLE scooter_ev (
+                    scooter_id INT PRIMARY KEY IDENTITY(1,1),
+                    scooter_name NVARCHAR(255) NOT NULL,
+                    segment_id INT NOT NULL,
+                    segment_name NVARCHAR(255) NOT NULL,
+                    model_type NVARCHAR(255),
+                    year INT,
+                    motor_type NVARCHAR(255),
+                    battery_type NVARCHAR(255),
+                    price DECIMAL(10, 2),
+                    image_data NVARCHAR(MAX),
+                    front_view NVARCHAR(MAX),
+                    back_view NVARCHAR(MAX),
+                    left_side_view NVARCHAR(MAX),
+                    right_side_view NVARCHAR(MAX)
+                );
+            END;
+        """],
+        "sqlite": ["""
+            CREATE TABLE IF NOT EXISTS scooter_ev (
+                scooter_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scooter_name TEXT NOT NULL,
+                segment_id INTEGER NOT NULL,
+                segment_name TEXT NOT NULL,
+                model_type TEXT,
+                year INTEGER,
+                motor_type TEXT,
+                battery_type TEXT,
+                price DECIMAL(10, 2),
+                image_data TEXT,
+                front_view TEXT,
+                back_view TEXT,
+                left_side_view TEXT,
+                right_side_view TEXT
+            )
+        """],
+    }),
+    (3, "index_model_type_segment_id", {
+        "mssql": [
+            """
+            IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='ix_cars_model_type_segment_id')
+                CREATE INDEX ix_cars_model_type_segment_id ON cars (model_type, segment_id);
+            """,
+            """
+            IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='ix_scooter_ev_model_type_segment_id')
+                CREATE INDEX ix_scooter_ev_model_type_segment_id ON scooter_ev (model_type, segment_id);
+            """,
+        ],
+        "sqlite": [
+            "CREATE INDEX IF NOT EXISTS ix_cars_model_type_segment_id ON cars (model_type, segment_id)",
+            "CREATE INDEX IF NOT EXISTS ix_scooter_ev_model_type_segment_id ON scooter_ev (model_type, segment_id)",
+        ],
+    }),
+    # The final index set of both tables. The natural key becomes a unique index so
+    # uploads can insert-if-absent in one statement; for scooter_ev that is
+    # (model_type, segment_id), the check scooter.py always made: one scooter per model
+    # type and segment. unique_segment (segment_id, segment_name) is dropped, since it
+    # rejected a second car in the same segment; SQLite cannot drop a table constraint,
+    # so cars is rebuilt there inside one transaction. Covering indexes serve the image
+    # lookups of the scratch services without touching the base table: SQL Server
+    # carries the image URLs as INCLUDE columns, SQLite has no INCLUDE, so they trail
+    # the key instead. They supersede the plain (model_type, segment_id) indexes of
+    # migration 3.
+    (4, "lookup_indexes", {
+        "mssql": [
+            """
+            IF EXISTS (SELECT * FROM sys.key_constraints WHERE name='unique_segment')
+                ALTER TABLE cars DROP CONSTRAINT unique_segment;
+            """,
+            """
+            IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='ux_cars_natural_key')
+                CREATE UNIQUE INDEX ux_cars_natural_key ON cars (segment_id, segment_name, model_type, car_name, year);
+            """,
+            """
+            IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='ux_scooter_ev_model_type_segment_id')
+                CREATE UNIQUE INDEX ux_scooter_ev_model_type_segment_id ON scooter_ev (model_type, segment_id);
+            """,
+            """
+            IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='ix_cars_image_lookup')
+                CREATE INDEX ix_cars_image_lookup ON cars (model_type, segment_id)
+                    INCLUDE (segment_name, image_data, front_view, back_view, left_side_view, right_side_view);
+            """,
+            """
+            IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='ix_scooter_ev_image_lookup')
+                CREATE INDEX ix_scooter_ev_image_lookup ON scooter_ev (model_type, segment_id)
+                    INCLUDE (segment_name, image_data, front_view, back_view, left_side_view, right_side_view);
+            """,
+            """
+            IF EXISTS (SELECT * FROM sys.indexes WHERE name='ix_cars_model_type_segment_id')
+                DROP INDEX ix_cars_model_type_segment_id ON cars;
+            """,
+            """
+            IF EXISTS (SELECT * FROM sys.indexes WHERE name='ix_scooter_ev_model_type_segment_id')
+                DROP INDEX ix_scooter_ev_model_type_segment_id ON scooter_ev;
+            """,
+        ],
+        "sqlite": [
+            "BEGIN",
+            """
+            CREATE TABLE cars_rebuild (
+                car_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                car_name TEXT NOT NULL,
+                segment_id INTEGER NOT NULL,
+                segment_name TEXT NOT NULL,
+                model_type TEXT,
+                year INTEGER,
+                engine_type TEXT,
+                fuel_type TEXT,
+                price DECIMAL(10, 2),
+                image_data TEXT,
+                front_view TEXT,
+                back_view TEXT,
+                left_side_view TEXT,
+                right_side_view TEXT
+            )
+            """,
+            "INSERT INTO cars_rebuild SELECT * FROM cars",
+            "DROP TABLE cars",
+            "ALTER TABLE cars_rebuild RENAME TO cars",
+            "CREATE UNIQUE INDEX ux_cars_natural_key ON cars (segment_id, segment_name, model_type, car_name, year)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_scooter_ev_model_type_segment_id ON scooter_ev (model_type, segment_id)",
+            """
+            CREATE INDEX ix_cars_image_lookup ON cars (model_type, segment_id,
+                segment_name, image_data, front_view, back_view, left_side_view, right_side_view)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_scooter_ev_image_lookup ON scooter_ev (model_type, segment_id,
+                segment_name, image_data, front_view, back_view, left_side_view, right_side_view)
+            """,
+            "DROP INDEX IF EXISTS ix_scooter_ev_model_type_segment_id",
+        ],
+    }),
+]
+
+MIGRATION_LOG_DDL = {
+    "mssql": """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='schema_migrations' AND xtype='U')
+        BEGIN
+            CREATE TABLE schema_migrations (
+                version INT PRIMARY KEY,
+                name NVARCHAR(255) NOT NULL,
+                applied_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+            );
+        END;
+    """,
+    "sqlite": """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+}
+
+_ready = weakref.WeakSet()
+_ready_lock = threading.Lock()
+
+
+def applied_versions(cursor):
+    """Return the set of migration versions already recorded in the migration log."""
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn, dialect, target_version=None):
+    """Apply every pending migration on conn in version order and return the versions applied.
+
+    Each migration is committed together with its migration log entry; one that fails
+    is rolled back. With target_version, migrations after that version are left pending.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(MIGRATION_LOG_DDL[dialect])
+        conn.commit()
+
+        done = applied_versions(cursor)
+        applied = []
+        for version, name, statements in MIGRATIONS:
+            if version in done or (target_version is not None and version > target_version):
+                continue
+            try:
+                for statement in statements[dialect]:
+                    cursor.execute(statement)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            logging.info(f"Applied schema migration {version} ({name}).")
+            applied.append(version)
+        return applied
+    finally:
+        cursor.close()
+
+
+def ensure_schema(db_config):
+    """Bring the schema up to date once per process; later calls return without touching the database."""
+    pool = db_pool.get_pool(db_config)
+    if pool in _ready:
+        return
+    with _ready_lock:
+        if pool in _ready:
+            return
+        with pool.connection() as conn:
+            migrate(conn, pool.dialect)
+        _ready.add(pool)
+
+
+def bootstrap(db_config):
+    """Run ensure_schema at process start, logging instead of raising if the database is unreachable."""
+    try:
+        ensure_schema(db_config)
+    except Exception as e:
+        logging.error(f"Schema bootstrap failed, it will be retried on the first write: {e}")
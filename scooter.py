@@ -1,64 +1,39 @@
-from flask import Flask, request, jsonify
+import json
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 import pyodbc
-import cloudinary
-import cloudinary.uploader
 
-app = Flask(__name__)
+import catalog
+import config
+import db_pool
+import image_context
+import ingest
+import response_cache
+import schema
+import spool
+import uploads
 
+bp = Blueprint('scooters', __name__)
 
-cloudinary.config(
-    cloud_name="dti4ah9gr",
-    api_key="455798993897116",
-    api_secret="vshhZXiIhvzENBBblhbAXLXjxXs"
-)
 
-
-db_config = {
-    'server': 'mohitsikhan.database.windows.net',
-    'database': 'car_rent',
-    'user': 'mohitsikhan',
-    'password': 'Mohit@210',
-}
+db_config = config.settings.db_config
 
 def get_db_connection():
-    """Establish a connection to the Azure SQL Database."""
-    return pyodbc.connect(
-        f"Driver={{ODBC Driver 18 for SQL Server}};"
-        f"Server={db_config['server']};"
-        f"Database={db_config['database']};"
-        f"UID={db_config['user']};"
-        f"PWD={db_config['password']};"
-    )
+    """Check a connection to the Azure SQL Database out of the shared pool."""
+    return db_pool.get_pool(db_config).connection()
 
-def create_table(cursor):
-    """Create the scooter_ev table if it does not already exist."""
-    cursor.execute("""
-        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='scooter_ev' AND xtype='U')
-        BEGIN
-            CREATE TABLE scooter_ev (
-                scooter_id INT PRIMARY KEY IDENTITY(1,1),
-                scooter_name NVARCHAR(255) NOT NULL,
-                segment_id INT NOT NULL,
-                segment_name NVARCHAR(255) NOT NULL,
-                model_type NVARCHAR(255),
-                year INT,
-                motor_type NVARCHAR(255),
-                battery_type NVARCHAR(255),
-                price DECIMAL(10, 2),
-                image_data NVARCHAR(MAX),
-                front_view NVARCHAR(MAX),
-                back_view NVARCHAR(MAX),
-                left_side_view NVARCHAR(MAX),
-                right_side_view NVARCHAR(MAX)
-            );
-        END;
-    """)
-    cursor.commit()
+@bp.record_once
+def bootstrap_schema(state):
+    # Create tables and indexes once at startup instead of on every request
+    schema.bootstrap(db_config)
 
-@app.route("/upload-scooter", methods=["POST"])
+@bp.route("/upload-scooter", methods=["POST"])
 def upload_scooter():
     """Endpoint to upload scooter details and images."""
-    data = request.json
+    # JSON with server-side image paths, or multipart with one file part per image column
+    try:
+        data = spool.request_payload(request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     image_paths = data.get("image_paths", {})
     scooter_name = data.get("scooter_name")
     segment_id = data.get("segment_id")
@@ -72,43 +47,46 @@ def upload_scooter():
     if not all([scooter_name, segment_id, segment_name, model_type, year, motor_type, battery_type, price, image_paths]):
         return jsonify({"error": "Missing required fields"}), 400
 
-    image_urls = {}
-    for column, image_path in image_paths.items():
-        try:
-            response = cloudinary.uploader.upload(image_path)
-            image_urls[column] = response.get("secure_url")
-        except Exception as e:
-            return jsonify({"error": f"Failed to upload {column}: {e}"}), 500
+    # Each file is read once and the same bytes are hashed and uploaded
+    image_urls, upload_errors = uploads.upload_many(image_context.load_images(image_paths))
+    if upload_errors:
+        column, e = next(iter(upload_errors.items()))
+        return jsonify({"error": f"Failed to upload {column}: {e}"}), 500
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        create_table(cursor)
-
-        # Insert scooter details
-        cursor.execute("""
-            IF NOT EXISTS (
-                SELECT 1 FROM scooter_ev WHERE model_type = ? AND segment_id = ?
-            )
-            INSERT INTO scooter_ev (scooter_name, segment_id, segment_name, model_type, year, motor_type, battery_type, price,
-                                   image_data, front_view, back_view, left_side_view, right_side_view)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            model_type, segment_id,
-            scooter_name, segment_id, segment_name, model_type, year, motor_type, battery_type, price,
-            image_urls.get("image_data"), image_urls.get("front_view"),
-            image_urls.get("back_view"), image_urls.get("left_side_view"),
-            image_urls.get("right_side_view")
-        ))
-        cursor.commit()
-        return jsonify({"message": f"Scooter '{scooter_name}' uploaded successfully."}), 201
-    except pyodbc.Error as e:
+        schema.ensure_schema(db_config)
+        details = {
+            "scooter_name": scooter_name, "segment_id": segment_id, "segment_name": segment_name, "model_type": model_type,
+            "year": year, "motor_type": motor_type, "battery_type": battery_type, "price": price,
+        }
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Insert scooter details unless the segment already has a scooter of this model type, in one statement
+                inserted = catalog.upsert(cursor, db_pool.get_pool(db_config).dialect, catalog.SCOOTERS,
+                                          catalog.row_values(catalog.SCOOTERS, details, image_urls))
+                conn.commit()
+            finally:
+                cursor.close()
+        if not inserted:
+            return jsonify({"message": f"A {model_type} scooter already exists in segment {segment_id}.", "status": "duplicate"}), 200
+        response_cache.invalidate(catalog.SCOOTERS['table'], [segment_id])
+        return jsonify({"message": f"Scooter '{scooter_name}' uploaded successfully.", "status": "inserted"}), 201
+    except (pyodbc.Error, db_pool.PoolTimeout) as e:
         return jsonify({"error": f"Database error: {e}"}), 500
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+
+@bp.route('/upload-scooter/bulk', methods=['POST'])
+def upload_scooters_bulk():
+    """Bulk-load vehicles from an NDJSON or CSV request body, streaming NDJSON progress back per chunk."""
+    fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    lines = (line.decode('utf-8') for line in request.stream)
+
+    def generate():
+        for progress in ingest.ingest(lines, fmt, catalog.SCOOTERS, db_config):
+            yield json.dumps(progress) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    import service
+    service.run(['scooter'], {}, 'scooter')
@@ -0,0 +1,424 @@
+import io
+import os
+import time
+import warnings
+from contextlib import contextmanager, nullcontext
+
+import cv2
+import numpy as np
+
+
+COMPARE_SIZE = (500, 500)
+
+# Decode settings using Environment Variables. Photos are decoded at the smallest
+# scale (1/2, 1/4 or 1/8, done inside libjpeg for JPEGs) that still covers
+# COMPARE_SIZE, and incoming photos above either ceiling are refused before decoding.
+SCRATCH_REDUCED_DECODE = os.getenv("SCRATCH_REDUCED_DECODE", "1") == "1"
+DECODE_MAX_BYTES = int(os.getenv("DECODE_MAX_BYTES", str(50 * 1024 * 1024)))
+DECODE_MAX_PIXELS = int(os.getenv("DECODE_MAX_PIXELS", str(100 * 1000 * 1000)))
+
+# (colour, scale factor) -> cv2.imread flag
+DECODE_FLAGS = {
+    (False, 1): cv2.IMREAD_GRAYSCALE,
+    (False, 2): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (False, 4): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (False, 8): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    (True, 1): cv2.IMREAD_COLOR,
+    (True, 2): cv2.IMREAD_REDUCED_COLOR_2,
+    (True, 4): cv2.IMREAD_REDUCED_COLOR_4,
+    (True, 8): cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Coarse tier settings using Environment Variables. A signature is the 25x25 thumbnail
+# of 20x20 block means of a decoded grayscale frame before enhancement; when no block of
+# a pair differs by more than the profile's signature_tolerance, the pair is settled
+# without enhancing or comparing it. The tolerance is set per profile
+# (CAR_SIGNATURE_TOLERANCE, SCOOTER_SIGNATURE_TOLERANCE) and the tier is off while it is
+# unset, until a value has been calibrated against the full pipeline. With tiled mode
+# the full pipeline only runs over the bounding box of the blocks that did differ.
+SIGNATURE_BLOCK = 20
+SIGNATURE_SHAPE = (COMPARE_SIZE[1] // SIGNATURE_BLOCK, COMPARE_SIZE[0] // SIGNATURE_BLOCK)
+SCRATCH_TILED_FULL_TIER = os.getenv("SCRATCH_TILED_FULL_TIER", "0") == "1"
+TILE_MARGIN = 8  # pixels of context around flagged blocks for blur/Canny/closing
+
+
+def _tolerance(name):
+    value = os.getenv(name, "")
+    return float(value) if value else None
+
+
+# Per-service tuning of the comparison pipeline. scratch.py (cars) enhances both images
+# with CLAHE and closes gaps in the edge map; scratchscooter.py (scooters) compares plain
+# grayscale with a min-max normalised difference and a more sensitive Canny threshold.
+CAR_PROFILE = {
+    'name': 'car',
+    'decode_color': False,
+    'clahe': True,
+    'normalize': False,
+    'blur_ksize': (7, 7),
+    'canny': (50, 200),
+    'morph_close': True,
+    'min_contour_area': 50,
+    'signature_tolerance': _tolerance("CAR_SIGNATURE_TOLERANCE"),
+}
+
+SCOOTER_PROFILE = {
+    'name': 'scooter',
+    'decode_color': True,
+    'clahe': False,
+    'normalize': True,
+    'blur_ksize': (5, 5),
+    'canny': (20, 100),
+    'morph_close': False,
+    'min_contour_area': 10,
+    'signature_tolerance': _tolerance("SCOOTER_SIGNATURE_TOLERANCE"),
+}
+
+PROFILES = {profile['name']: profile for profile in (CAR_PROFILE, SCOOTER_PROFILE)}
+
+
+@contextmanager
+def timed(timings, stage):
+    """Add the seconds spent in the block to timings[stage]; a no-op when timings is None.
+
+    The pipeline stays free of any metrics backend: callers pass a dict and report it,
+    which also works when the comparison runs in a worker process.
+    """
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+def prepare(gray_resized, profile, timings=None):
+    """Apply the profile's enhancement step to a 500x500 grayscale image."""
+    if profile['clahe']:
+        with timed(timings, 'clahe'):
+            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+            return clahe.apply(gray_resized)
+    return gray_resized
+
+
+class ImageTooLarge(ValueError):
+    """Raised for an incoming photo above DECODE_MAX_BYTES or DECODE_MAX_PIXELS."""
+
+
+def _source(image_path):
+    """What to hand PIL for a path, encoded bytes or image_context.ImageBuffer."""
+    data = getattr(image_path, 'data', image_path)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return io.BytesIO(data)
+    return data
+
+
+def encoded_size(image_path):
+    """Size in bytes of the encoded image, or None if unknown."""
+    data = getattr(image_path, 'data', image_path)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data)
+    try:
+        return os.path.getsize(data)
+    except (OSError, TypeError):
+        return None
+
+
+def image_dimensions(image_path):
+    """(width, height) read from the image header without decoding the pixels, or None if unknown.
+
+    Raises ImageTooLarge when the header alone shows a decompression bomb.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(_source(image_path)) as image:
+                return image.size
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except Exception:
+        return None  # not something PIL knows; let OpenCV try
+
+
+def check_limits(image_path, max_bytes=DECODE_MAX_BYTES, max_pixels=DECODE_MAX_PIXELS):
+    """Raise ImageTooLarge unless the photo is within both ceilings; returns its (width, height) or None."""
+    size = encoded_size(image_path)
+    if size is not None and size > max_bytes:
+        raise ImageTooLarge(f"{image_path} is {size} bytes, more than {max_bytes}")
+    dimensions = image_dimensions(image_path)
+    if dimensions is not None and dimensions[0] * dimensions[1] > max_pixels:
+        raise ImageTooLarge(f"{image_path} is {dimensions[0]}x{dimensions[1]}, more than {max_pixels} pixels")
+    return dimensions
+
+
+def decode_flags(dimensions, color, size=COMPARE_SIZE):
+    """The cv2.imread flag decoding at the largest 1/2, 1/4 or 1/8 reduction that still covers size."""
+    factor = 1
+    if SCRATCH_REDUCED_DECODE and dimensions is not None:
+        width, height = dimensions
+        for candidate in (8, 4, 2):
+            if -(-width // candidate) >= size[0] and -(-height // candidate) >= size[1]:
+                factor = candidate
+                break
+    return DECODE_FLAGS[(color, factor)]
+
+
+def read_image(image_path, flags):
+    """cv2.imread for a path; in-memory images (image_context.ImageBuffer) decode their own buffer."""
+    if hasattr(image_path, 'imdecode'):
+        return image_path.imdecode(flags)
+    return cv2.imread(image_path, flags)
+
+
+def load_new_image(image_path, profile):
+    """Read an incoming photo and return it prepared for comparison, or None if unreadable.
+
+    In-memory images (image_context.ImageBuffer) are prepared once per profile and
+    the same frame is returned on every later call.
+    """
+    if hasattr(image_path, 'prepared'):
+        return image_path.prepared(profile)
+    gray = decode_new_image(image_path, profile)
+    return None if gray is None else prepare(gray, profile)
+
+
+def load_new_signature(image_path, profile):
+    """Signature of an incoming in-memory photo (image_context.ImageBuffer), or None.
+
+    Photos given as paths, or that cannot be decoded, have no signature and are left
+    to the full pipeline.
+    """
+    if hasattr(image_path, 'signature'):
+        return image_path.signature(profile)
+    return None
+
+
+def decode_new_image(image_path, profile, timings=None, memory=None):
+    """Decode and resize one incoming photo to a grayscale frame, not yet enhanced; None if it cannot be decoded.
+
+    Raises ImageTooLarge for photos over the decode ceilings. memory, when given, is
+    an image_context.DecodeMemory that holds the decoded frame's bytes until it has
+    been resized.
+    """
+    with timed(timings, 'decode'):
+        flags = decode_flags(check_limits(image_path), profile['decode_color'])
+        image = read_image(image_path, flags)
+        if image is None:
+            return None
+        with memory.hold(image.nbytes) if memory is not None else nullcontext():
+            gray = to_gray(image, profile)
+            del image
+    return gray
+
+
+def to_gray(image, profile, size=COMPARE_SIZE):
+    """Resize a frame decoded with the profile's decode_color to size and convert it to grayscale.
+
+    New photos and stored references both go through here, so identical bytes give
+    identical frames under every profile.
+    """
+    if profile['decode_color']:
+        return cv2.cvtColor(cv2.resize(image, size), cv2.COLOR_BGR2GRAY)
+    return cv2.resize(image, size)
+
+
+def compare(new_prepared, reference_prepared, profile, debug_writer=None, timings=None):
+    """Return True when the prepared images differ by at least one contour above the profile's area threshold.
+
+    debug_writer, when given, is called as debug_writer(name, image) for every
+    intermediate stage; timings, when given, accumulates the edge stage as
+    'canny_contours'.
+    """
+    diff_image = cv2.absdiff(new_prepared, reference_prepared)
+    if profile['normalize']:
+        diff_image = cv2.normalize(diff_image, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
+    if debug_writer:
+        debug_writer("diff_image", diff_image)
+
+    blurred_diff = cv2.GaussianBlur(diff_image, profile['blur_ksize'], 0)
+    if debug_writer:
+        debug_writer("blurred_diff", blurred_diff)
+
+    with timed(timings, 'canny_contours'):
+        edges = cv2.Canny(blurred_diff, *profile['canny'])
+        if debug_writer:
+            debug_writer("edges", edges)
+
+        if profile['morph_close']:
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+            edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+            if debug_writer:
+                debug_writer("morphed_edges", edges)
+
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return any(cv2.contourArea(contour) > profile['min_contour_area'] for contour in contours)
+
+
+def _normalize_stack(diff_stack):
+    """Per-frame NORM_MINMAX to 0..255.
+
+    cv2.normalize runs on each frame rather than as one NumPy expression so the
+    rounding is OpenCV's, and the result is exactly what compare() computes.
+    """
+    normalized = np.empty_like(diff_stack)
+    for i, frame in enumerate(diff_stack):
+        normalized[i] = cv2.normalize(frame, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
+    return normalized
+
+
+def _blur_stack(stack, ksize):
+    """GaussianBlur every frame in one call by stacking them vertically.
+
+    Each frame is padded with its own reflected rows (OpenCV's default
+    BORDER_REFLECT_101) so no frame bleeds into its neighbour and the result is
+    identical to blurring the frames one by one.
+    """
+    count, height, width = stack.shape
+    pad = ksize[1] // 2
+    padded = np.pad(stack, ((0, 0), (pad, pad), (0, 0)), mode="reflect")
+    blurred = cv2.GaussianBlur(padded.reshape(count * (height + 2 * pad), width), ksize, 0)
+    return blurred.reshape(count, height + 2 * pad, width)[:, pad:pad + height, :]
+
+
+def signature(gray):
+    """Block-mean thumbnail of a 500x500 grayscale frame taken before enhancement, as float32."""
+    height, width = gray.shape
+    blocks = gray.reshape(height // SIGNATURE_BLOCK, SIGNATURE_BLOCK, width // SIGNATURE_BLOCK, SIGNATURE_BLOCK)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def signature_diff(signatures, profile):
+    """Per-block difference of a (new, reference) signature pair.
+
+    None when the profile has no signature_tolerance or either signature is missing.
+    """
+    if profile['signature_tolerance'] is None or signatures is None or any(s is None for s in signatures):
+        return None
+    new_signature, reference_signature = signatures
+    return np.abs(new_signature - reference_signature)
+
+
+def settle_on_signatures(signatures, profile):
+    """The 'signature' tier outcome when no block of the pair differs by more than the tolerance, else None."""
+    block_diff = signature_diff(signatures, profile)
+    if block_diff is None:
+        return None
+    outcome = _signature_stats(block_diff)
+    if outcome['thumbnail_max_diff'] > profile['signature_tolerance']:
+        return None
+    return dict(outcome, scratch_detected=False, tier='signature')
+
+
+def _signature_stats(block_diff):
+    return {
+        'thumbnail_mad': float(block_diff.mean()),
+        'thumbnail_max_diff': float(block_diff.max()),
+    }
+
+
+def _flagged_region(flagged_blocks, shape):
+    """Pixel bounding box (y0, y1, x0, x1) of the flagged thumbnail blocks, padded by TILE_MARGIN."""
+    rows = np.flatnonzero(flagged_blocks.any(axis=1))
+    cols = np.flatnonzero(flagged_blocks.any(axis=0))
+    y0 = max(0, rows[0] * SIGNATURE_BLOCK - TILE_MARGIN)
+    y1 = min(shape[0], (rows[-1] + 1) * SIGNATURE_BLOCK + TILE_MARGIN)
+    x0 = max(0, cols[0] * SIGNATURE_BLOCK - TILE_MARGIN)
+    x1 = min(shape[1], (cols[-1] + 1) * SIGNATURE_BLOCK + TILE_MARGIN)
+    return y0, y1, x0, x1
+
+
+def compare_tiered(new_prepared, reference_prepared, profile, debug_writer=None,
+                   tiled=SCRATCH_TILED_FULL_TIER, timings=None, signatures=None):
+    """Coarse-to-fine compare(): settle near-identical pairs on their signatures first.
+
+    signatures is the pair's (new, reference) signatures from before enhancement;
+    without them, or without a signature_tolerance in the profile, the pair goes
+    straight to the full pipeline. Returns a dict with scratch_detected, the tier
+    that decided ('signature', 'tiles' or 'full') and, when signatures were
+    compared, the thumbnail statistics, so the tolerance can be tuned against real
+    data. Tiled mode is ignored for profiles that normalise the difference image,
+    since that step depends on the whole frame.
+    """
+    block_diff = signature_diff(signatures, profile)
+    outcome = {}
+    if block_diff is not None:
+        outcome = _signature_stats(block_diff)
+        if outcome['thumbnail_max_diff'] <= profile['signature_tolerance']:
+            return dict(outcome, scratch_detected=False, tier='signature')
+
+    if tiled and block_diff is not None and not profile['normalize']:
+        y0, y1, x0, x1 = _flagged_region(block_diff > profile['signature_tolerance'], new_prepared.shape)
+        scratch_detected = compare(new_prepared[y0:y1, x0:x1], reference_prepared[y0:y1, x0:x1], profile, debug_writer, timings)
+        return dict(outcome, scratch_detected=scratch_detected, tier='tiles')
+
+    return dict(outcome, scratch_detected=compare(new_prepared, reference_prepared, profile, debug_writer, timings), tier='full')
+
+
+def failed_outcome(scratch_detected, tier='load_error', error=None):
+    """Outcome for a pair that could not be compared, e.g. because an image failed to load.
+
+    error, when given, is reported as the image's status instead of a verdict.
+    """
+    outcome = {'scratch_detected': scratch_detected, 'tier': tier}
+    if error is not None:
+        outcome['error'] = error
+    return outcome
+
+
+def too_large_outcome():
+    """Outcome for a new photo refused with ImageTooLarge; an error, never an image retained."""
+    return failed_outcome(False, tier='too_large', error='Error: image too large')
+
+
+def error_outcome():
+    """Outcome for a pair whose comparison raised, e.g. because the comparison pool failed; an error, never an image retained."""
+    return failed_outcome(False, tier='error', error='Error: comparison failed')
+
+
+def compare_batch(new_stack, reference_stack, profile, timings=None):
+    """Vectorised compare() over two (N, 500, 500) uint8 stacks of prepared images.
+
+    Pairs the signature tier can settle are left out by the caller (see
+    settle_on_signatures) before the frames are prepared and stacked. absdiff,
+    normalisation, blur and the per-frame statistics run once over the whole stack.
+    A 3x3 Sobel L1 gradient can be at most 8x a frame's value range, so frames whose
+    blurred difference is too flat to ever exceed the Canny high threshold are
+    settled without running Canny/contours ('flat_difference'); only the rest go
+    through the per-frame edge stage ('full'). Returns one outcome dict per frame,
+    like compare_tiered().
+    """
+    if not len(new_stack):
+        return []
+
+    diff_stack = cv2.absdiff(new_stack, reference_stack)
+    if profile['normalize']:
+        diff_stack = _normalize_stack(diff_stack)
+
+    blurred_stack = _blur_stack(diff_stack, profile['blur_ksize'])
+
+    blurred_min = blurred_stack.min(axis=(1, 2)).astype(np.int32)
+    blurred_max = blurred_stack.max(axis=(1, 2)).astype(np.int32)
+    needs_edges = 8 * (blurred_max - blurred_min) > profile['canny'][1]
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    results = []
+    for i in range(len(new_stack)):
+        scratch_detected = False
+        if needs_edges[i]:
+            with timed(timings, 'canny_contours'):
+                edges = cv2.Canny(blurred_stack[i], *profile['canny'])
+                if profile['morph_close']:
+                    edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+                contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                scratch_detected = any(cv2.contourArea(contour) > profile['min_contour_area'] for contour in contours)
+        results.append({
+            'scratch_detected': scratch_detected,
+            'tier': 'full' if needs_edges[i] else 'flat_difference',
+        })
+    return results
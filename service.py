@@ -0,0 +1,48 @@
+import importlib
+import logging
+
+from flask import Flask
+
+import config
+import metrics
+import spool
+
+
+# Blueprint modules and the URL prefix each is mounted under in the combined service.
+# The two inspection blueprints both define /upload-images and /jobs, so they get one each.
+PREFIXES = {
+    'kj': None,
+    'scooter': None,
+    'scratch': '/cars',
+    'scratchscooter': '/scooters',
+    'listings': '/catalog',
+}
+
+
+def create_app(blueprints=None, prefixes=PREFIXES, name='vehicle', settings=config.settings):
+    """Build one Flask app serving the given blueprint modules (settings.blueprints by default).
+
+    Modules are imported here, so a service that does not mount the inspection
+    blueprints never imports OpenCV or NumPy; those that do import them on their
+    first inspection request.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    settings.configure_cloudinary()
+
+    app = Flask(__name__)
+    app.request_class = spool.SpoolingRequest  # multipart image parts are spooled with bounds
+    metrics.instrument(app, name)
+
+    for module_name in blueprints or settings.blueprints:
+        module = importlib.import_module(module_name)
+        app.register_blueprint(module.bp, url_prefix=prefixes.get(module_name))
+    return app
+
+
+def run(blueprints=None, prefixes=PREFIXES, name='vehicle', settings=config.settings):
+    """Serve create_app(...) with the development server on settings.host:settings.port."""
+    create_app(blueprints, prefixes, name, settings).run(host=settings.host, port=settings.port, debug=settings.debug)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge, ServiceUnavailable
+
+import image_context
+import schema
+
+
+# Upload spooling settings using Environment Variables. Each image part of a multipart
+# request is written straight into a spool that stays in memory up to
+# SPOOL_MEMORY_BYTES and then spills to SPOOL_DIR; SPOOL_MAX_TOTAL_BYTES bounds what
+# all in-flight requests may hold at once.
+SPOOL_DIR = os.getenv("SPOOL_DIR") or None  # None uses the system temp directory
+SPOOL_MEMORY_BYTES = int(os.getenv("SPOOL_MEMORY_BYTES", str(1024 * 1024)))
+SPOOL_MAX_FILE_BYTES = int(os.getenv("SPOOL_MAX_FILE_BYTES", str(25 * 1024 * 1024)))
+SPOOL_MAX_REQUEST_BYTES = int(os.getenv("SPOOL_MAX_REQUEST_BYTES", str(150 * 1024 * 1024)))
+SPOOL_MAX_TOTAL_BYTES = int(os.getenv("SPOOL_MAX_TOTAL_BYTES", str(1024 * 1024 * 1024)))
+
+
+class SpoolLimitExceeded(RequestEntityTooLarge):
+    """A single uploaded image is larger than SPOOL_MAX_FILE_BYTES (413)."""
+
+
+class SpoolFull(ServiceUnavailable):
+    """All in-flight uploads together already hold SPOOL_MAX_TOTAL_BYTES (503)."""
+
+
+_spooled_bytes = 0
+_spooled_lock = threading.Lock()
+
+
+def _reserve(size):
+    global _spooled_bytes
+    with _spooled_lock:
+        if _spooled_bytes + size > SPOOL_MAX_TOTAL_BYTES:
+            raise SpoolFull("Upload storage is full, retry shortly")
+        _spooled_bytes += size
+
+
+def _release(reserved):
+    """Give back the bytes counted in the one-element list reserved; safe to call twice."""
+    global _spooled_bytes
+    with _spooled_lock:
+        _spooled_bytes -= reserved[0]
+        reserved[0] = 0
+
+
+class ImageSpool(tempfile.SpooledTemporaryFile):
+    """Bounded spool for one uploaded file that hashes the bytes as they are written."""
+
+    def __init__(self, max_bytes=SPOOL_MAX_FILE_BYTES, memory_bytes=SPOOL_MEMORY_BYTES, directory=SPOOL_DIR):
+        super().__init__(max_size=memory_bytes, dir=directory)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._reserved = [0]
+        weakref.finalize(self, _release, self._reserved)
+
+    def write(self, data):
+        if self.size + len(data) > self.max_bytes:
+            raise SpoolLimitExceeded(f"Uploaded image exceeds {self.max_bytes} bytes")
+        _reserve(len(data))
+        self._reserved[0] += len(data)
+        self.size += len(data)
+        self.sha256.update(data)
+        return super().write(data)
+
+    def close(self):
+        super().close()
+        _release(self._reserved)
+
+
+class SpoolingRequest(Request):
+    """Flask request whose multipart file parts are written into ImageSpools."""
+
+    max_content_length = SPOOL_MAX_REQUEST_BYTES
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return ImageSpool()
+
+
+class SpooledImage(image_context.ImageBuffer):
+    """An uploaded image, read from its spool exactly once into an in-memory ImageBuffer.
+
+    The in-memory copy counts against SPOOL_MAX_TOTAL_BYTES, like the spool itself,
+    until the SpooledImage is garbage collected.
+    """
+
+    def __init__(self, filename, spool):
+        size = spool.seek(0, os.SEEK_END)
+        _reserve(size)
+        self._reserved = [size]
+        weakref.finalize(self, _release, self._reserved)
+        spool.seek(0)
+        data = spool.read()
+        digest = spool.sha256.hexdigest() if isinstance(spool, ImageSpool) else None
+        super().__init__(filename, data, digest)
+
+
+def request_images(request):
+    """Return {column: SpooledImage} for the image parts of a multipart request.
+
+    Parts are named after the image column they replace; unknown names raise ValueError.
+    """
+    schema.image_columns(list(request.files))
+    return {
+        column: SpooledImage(storage.filename, storage.stream)
+        for column, storage in request.files.items()
+    }
+
+
+def request_payload(request):
+    """The JSON body, or for a multipart request its form fields plus image_paths built from its file parts."""
+    if request.mimetype != 'multipart/form-data':
+        return request.get_json()
+    data = request.form.to_dict()
+    data['image_paths'] = request_images(request)
+    return data
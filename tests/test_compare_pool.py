@@ -0,0 +1,34 @@
+import os
+import signal
+
+import numpy as np
+import pytest
+
+import compare_pool
+import scratch_pipeline
+
+
+@pytest.fixture
+def pool():
+    pool = compare_pool.ComparePool(workers=1, max_pending=4, submit_timeout=5)
+    pool.warm()
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_recovers_after_a_worker_dies(pool):
+    frame = np.zeros((500, 500), dtype=np.uint8)
+    os.kill(pool._executor.submit(os.getpid).result(), signal.SIGKILL)
+
+    outcome = pool.compare(frame, frame, scratch_pipeline.CAR_PROFILE)
+    outcomes = pool.submit_batch(np.stack([frame]), np.stack([frame]), scratch_pipeline.CAR_PROFILE).result()
+
+    assert outcome['scratch_detected'] is False
+    assert [outcome['scratch_detected'] for outcome in outcomes] == [False]
+
+
+def test_error_outcome_is_reported_not_retained():
+    outcome = scratch_pipeline.error_outcome()
+
+    assert outcome['scratch_detected'] is False
+    assert outcome['error'].startswith("Error")
@@ -0,0 +1,155 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import downloads
+
+
+IMAGE = bytes(range(256)) * 64
+ETAG = '"image-v1"'
+
+
+class CDNHandler(BaseHTTPRequestHandler):
+    """Stand-in for the CDN: a cacheable image, a missing one, and bodies of any size."""
+
+    def do_GET(self):
+        if self.path == "/image.jpg":
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_response(304)
+                self.send_header("ETag", ETAG)
+                self.end_headers()
+                return
+            self._send(IMAGE, {"ETag": ETAG})
+        elif self.path.startswith("/sized/"):
+            self._send(b"s" * int(self.path.rsplit("/", 1)[1]))
+        elif self.path.startswith("/unsized/"):
+            # No Content-Length: the body runs until the connection closes
+            self.send_response(200)
+            self.end_headers()
+            size = int(self.path.rsplit("/", 1)[1])
+            for start in range(0, size, 64 * 1024):
+                self.wfile.write(b"u" * min(64 * 1024, size - start))
+        else:
+            self.send_error(404)
+
+    def _send(self, body, headers=None):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def cdn():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CDNHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_buffer(monkeypatch):
+    monkeypatch.setattr(downloads, "_buffers", threading.local())
+
+
+def test_fetch_returns_body_and_headers(cdn):
+    status, body, headers = downloads.fetch(f"{cdn}/image.jpg")
+
+    assert status == 200
+    assert bytes(body) == IMAGE
+    assert headers["ETag"] == ETAG
+
+
+def test_fetch_not_modified_returns_no_body(cdn):
+    status, body, headers = downloads.fetch(f"{cdn}/image.jpg", headers={"If-None-Match": ETAG})
+
+    assert status == 304
+    assert body is None
+    assert headers["ETag"] == ETAG
+
+
+def test_fetch_missing_raises(cdn):
+    with pytest.raises(httpx.HTTPStatusError):
+        downloads.fetch(f"{cdn}/missing.jpg")
+
+
+def test_fetch_rejects_declared_oversize_body(cdn, monkeypatch):
+    monkeypatch.setattr(downloads, "DOWNLOAD_MAX_BYTES", 1000)
+
+    with pytest.raises(downloads.DownloadTooLarge):
+        downloads.fetch(f"{cdn}/sized/1001")
+    assert bytes(downloads.fetch(f"{cdn}/sized/1000")[1]) == b"s" * 1000
+
+
+def test_fetch_aborts_undeclared_oversize_body(cdn, monkeypatch):
+    monkeypatch.setattr(downloads, "DOWNLOAD_MAX_BYTES", 200 * 1024)
+
+    with pytest.raises(downloads.DownloadTooLarge):
+        downloads.fetch(f"{cdn}/unsized/{300 * 1024}")
+
+
+def test_fetch_grows_buffer_for_undeclared_body(cdn):
+    size = 1024 * 1024  # four times the initial buffer
+
+    status, body, _ = downloads.fetch(f"{cdn}/unsized/{size}")
+
+    assert status == 200
+    assert bytes(body) == b"u" * size
+    assert len(downloads._buffers.data) >= size
+
+
+def test_fetch_reuses_buffer_for_smaller_body(cdn):
+    downloads.fetch(f"{cdn}/sized/{512 * 1024}")
+    buffer = downloads._buffers.data
+
+    _, body, _ = downloads.fetch(f"{cdn}/image.jpg")
+
+    assert downloads._buffers.data is buffer
+    assert bytes(body) == IMAGE
+
+
+def test_prefetch_starts_keys_in_order():
+    started = []
+    lock = threading.Lock()
+
+    def load(key):
+        with lock:
+            started.append(key)
+        if key == 3:
+            raise ValueError("broken reference")
+
+    loaded = downloads.prefetch(load, range(10), max_concurrency=2, timeout=5)
+
+    assert loaded == 9
+    assert sorted(started) == list(range(10))
+    # At most max_concurrency loads are in flight, so no key starts more than one slot early
+    assert all(abs(position - key) <= 1 for position, key in enumerate(started))
+
+
+def test_prefetch_stops_at_timeout_and_skips_unstarted_keys():
+    release = threading.Event()
+    started = []
+
+    def load(key):
+        started.append(key)
+        release.wait(5)
+
+    began = time.monotonic()
+    loaded = downloads.prefetch(load, ["a", "b", "c", "d"], max_concurrency=2, timeout=0.2)
+    elapsed = time.monotonic() - began
+    release.set()
+
+    assert loaded == 0
+    assert elapsed < 2
+    time.sleep(0.1)
+    assert sorted(started) == ["a", "b"]
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import Counter
+
+import jobs
+
+
+def wait_for(queue, job_ids, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(queue.get(job_id)['status'] in (jobs.DONE, jobs.FAILED) for job_id in job_ids):
+            return
+        time.sleep(0.02)
+    raise AssertionError("jobs did not finish")
+
+
+def test_queues_sharing_a_database_run_each_job_once(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    runs = Counter()
+    lock = threading.Lock()
+
+    def handler(payload):
+        with lock:
+            runs[payload['n']] += 1
+        time.sleep(0.01)
+        return payload['n']
+
+    first = jobs.JobQueue({'inspect': handler}, path=path, workers=2)
+    second = jobs.JobQueue({'inspect': handler}, path=path, workers=2)
+    job_ids = [first.submit('inspect', {'n': n}) for n in range(20)]
+    second.start()  # picks up the same queued jobs; only one worker may claim each
+
+    wait_for(first, job_ids)
+    assert runs == Counter(range(20))
+    assert all(first.get(job_id)['attempts'] == 1 for job_id in job_ids)
+
+
+def test_start_leaves_running_jobs_with_a_live_lease_alone(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    release = threading.Event()
+    running = jobs.JobQueue({'inspect': lambda payload: release.wait(5)}, path=path, workers=1)
+    job_id = running.submit('inspect', {})
+    while running.get(job_id)['status'] != jobs.RUNNING:
+        time.sleep(0.01)
+
+    calls = []
+    other = jobs.JobQueue({'inspect': calls.append}, path=path, workers=1)
+    other.start()
+    time.sleep(0.1)
+    release.set()
+
+    wait_for(running, [job_id])
+    assert calls == []
+    assert running.get(job_id)['attempts'] == 1
+
+
+def test_start_requeues_running_jobs_whose_lease_expired(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    abandoned = jobs.JobQueue({'inspect': lambda payload: None}, path=path)
+    job_id = abandoned.submit('inspect', {})
+    wait_for(abandoned, [job_id])
+    # As left behind by a process that died mid-job
+    abandoned._conn.execute("UPDATE jobs SET status = ?, heartbeat_at = ? WHERE job_id = ?",
+                            (jobs.RUNNING, time.time() - 120, job_id))
+    abandoned._conn.commit()
+
+    resumed = jobs.JobQueue({'inspect': lambda payload: "resumed"}, path=path, lease_seconds=60)
+    resumed.start()
+
+    wait_for(resumed, [job_id])
+    assert resumed.get(job_id)['result'] == "resumed"
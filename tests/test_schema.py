@@ -0,0 +1,45 @@
+import sqlite3
+
+import pytest
+
+import schema
+
+
+def table_names(conn):
+    return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def index_names(conn):
+    return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_%'")}
+
+
+def test_migrations_leave_the_final_index_set(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "catalog.sqlite3"))
+
+    assert schema.migrate(conn, "sqlite") == [version for version, _, _ in schema.MIGRATIONS]
+    assert index_names(conn) == {
+        'ux_cars_natural_key', 'ix_cars_image_lookup',
+        'ux_scooter_ev_model_type_segment_id', 'ix_scooter_ev_image_lookup',
+    }
+    assert schema.migrate(conn, "sqlite") == []
+
+
+def test_failed_table_rebuild_is_rolled_back(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "catalog.sqlite3"))
+    schema.migrate(conn, "sqlite", target_version=3)
+    # Two rows with the same natural key make the unique index, created after the rebuild, fail
+    for name in ("first", "second"):
+        conn.execute("""
+            INSERT INTO scooter_ev (scooter_name, segment_id, segment_name, model_type, year)
+            VALUES (?, 1, 'city', 'kick', 2024)
+        """, (name,))
+    conn.execute("INSERT INTO cars (car_name, segment_id, segment_name, model_type, year) VALUES ('a', 1, 's', 'm', 2024)")
+    conn.commit()
+
+    with pytest.raises(sqlite3.IntegrityError):
+        schema.migrate(conn, "sqlite")
+
+    assert 'cars_rebuild' not in table_names(conn)
+    assert conn.execute("SELECT COUNT(*) FROM cars").fetchone() == (1,)
+    assert 4 not in schema.applied_versions(conn.cursor())
+    assert 'ix_cars_model_type_segment_id' in index_names(conn)
@@ -0,0 +1,98 @@
+import functools
+import hashlib
+
+import cv2
+import numpy as np
+import pytest
+
+import downloads
+import image_context
+import reference_cache
+import scratch_pipeline
+
+
+PROFILES = [scratch_pipeline.CAR_PROFILE, scratch_pipeline.SCOOTER_PROFILE]
+SIZES = [(640, 480), (1200, 900), (3000, 2000)]
+
+
+def photo(seed, width, height):
+    """A smooth colour photo with a solid shape in the middle, JPEG encoded."""
+    rng = np.random.default_rng(seed)
+    image = cv2.resize(rng.integers(0, 256, (height // 40, width // 40, 3), dtype=np.uint8), (width, height),
+                       interpolation=cv2.INTER_CUBIC)
+    cv2.circle(image, (width // 2, height // 2), min(width, height) // 5, (30, 200, 90), -1)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def reference_for(data, profile, tmp_path, monkeypatch):
+    """The prepared reference the services compare against when the stored photo is data."""
+    monkeypatch.setattr(downloads, "fetch", lambda url, headers=None: (200, data, {}))
+    cache = reference_cache.ReferenceImageCache(directory=str(tmp_path))
+    url = f"https://cdn.example/image/upload/v1/{hashlib.sha256(data).hexdigest()[:16]}.jpg"
+    return scratch_pipeline.prepare(cache.get(url, profile), profile)
+
+
+@pytest.mark.parametrize("profile", PROFILES, ids=lambda profile: profile['name'])
+@pytest.mark.parametrize("width,height", SIZES)
+@pytest.mark.parametrize("seed", range(3))
+def test_identical_photo_reports_no_scratch(profile, width, height, seed, tmp_path, monkeypatch):
+    data = photo(seed, width, height)
+
+    new = image_context.ImageBuffer("new.jpg", data).prepared(profile)
+    reference = reference_for(data, profile, tmp_path, monkeypatch)
+
+    assert np.array_equal(new, reference)
+    assert not scratch_pipeline.compare_tiered(new, reference, profile)['scratch_detected']
+
+
+@pytest.mark.parametrize("profile", PROFILES, ids=lambda profile: profile['name'])
+def test_reference_cache_keeps_profiles_apart(profile, tmp_path, monkeypatch):
+    data = photo(0, 1200, 900)
+    other = next(p for p in PROFILES if p is not profile)
+    monkeypatch.setattr(downloads, "fetch", lambda url, headers=None: (200, data, {}))
+    cache = reference_cache.ReferenceImageCache(directory=str(tmp_path))
+    url = "https://cdn.example/image/upload/v1/photo.jpg"
+
+    cache.get(url, other)
+
+    assert np.array_equal(cache.get(url, profile), reference_cache.decode_reference(data, profile))
+
+
+@functools.lru_cache(maxsize=None)
+def vehicle(width, height, seed):
+    """A synthetic vehicle photo, generated once for every profile and scratch count."""
+    import bench_pipeline
+    return bench_pipeline.synthetic_vehicle(width, height, seed)
+
+
+def full_decode_outcome(new_data, reference_data, profile):
+    """The verdict the services gave before reduced decoding: full-size decodes, then the same steps."""
+    flags = cv2.IMREAD_COLOR if profile['decode_color'] else cv2.IMREAD_GRAYSCALE
+    new, reference = (
+        scratch_pipeline.prepare(scratch_pipeline.to_gray(cv2.imdecode(np.frombuffer(data, np.uint8), flags), profile), profile)
+        for data in (new_data, reference_data)
+    )
+    return scratch_pipeline.compare(new, reference, profile)
+
+
+@pytest.mark.parametrize("profile", PROFILES, ids=lambda profile: profile['name'])
+@pytest.mark.parametrize("width,height", [(640, 480), (2048, 1536), (4000, 3000)])
+@pytest.mark.parametrize("scratches", [0, 1, 6])
+def test_reduced_decode_keeps_outcomes_on_clean_and_scratched_photos(profile, width, height, scratches, tmp_path, monkeypatch):
+    import bench_pipeline
+
+    for seed in range(4):
+        clean = vehicle(width, height, seed)
+        photo = bench_pipeline.add_scratches(clean, scratches, seed) if scratches else clean
+        reference_data = cv2.imencode(".jpg", clean)[1].tobytes()
+        new_data = cv2.imencode(".jpg", photo)[1].tobytes()
+
+        new = image_context.ImageBuffer("new.jpg", new_data).prepared(profile)
+        outcome = scratch_pipeline.compare_tiered(new, reference_for(reference_data, profile, tmp_path, monkeypatch), profile)
+        baseline = full_decode_outcome(new_data, reference_data, profile)
+
+        if not scratches:
+            assert not outcome['scratch_detected'] and not baseline
+        else:
+            # A reduced decode may resolve a faint scratch the full decode blurred away, never the reverse
+            assert outcome['scratch_detected'] or not baseline
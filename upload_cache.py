@@ -0,0 +1,90 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+# Dedup cache settings using Environment Variables; an empty path disables the cache
+UPLOAD_CACHE_PATH = os.getenv("UPLOAD_CACHE_PATH", "upload_cache.sqlite3")
+UPLOAD_CACHE_MAX_ENTRIES = int(os.getenv("UPLOAD_CACHE_MAX_ENTRIES", "100000"))
+
+
+def file_digest(image_path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of the file at image_path."""
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """Content-addressed index of uploaded images, persisted in SQLite with LRU eviction."""
+
+    def __init__(self, path=UPLOAD_CACHE_PATH, max_entries=UPLOAD_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS upload_cache (
+                digest TEXT PRIMARY KEY,
+                secure_url TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_upload_cache_last_used ON upload_cache (last_used)")
+        self._conn.commit()
+
+    def get(self, digest):
+        """Return the stored secure_url for digest, or None, and mark the entry as recently used."""
+        with self._lock:
+            row = self._conn.execute("SELECT secure_url FROM upload_cache WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE upload_cache SET last_used = ? WHERE digest = ?", (time.time(), digest))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, digest, secure_url):
+        """Record that the bytes with this digest live at secure_url, evicting the least recently used overflow."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO upload_cache (digest, secure_url, last_used) VALUES (?, ?, ?)",
+                (digest, secure_url, time.time()),
+            )
+            self._conn.execute("""
+                DELETE FROM upload_cache WHERE digest IN (
+                    SELECT digest FROM upload_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM upload_cache").fetchone()[0]
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache():
+    """Return the process-wide cache at UPLOAD_CACHE_PATH, or None when caching is disabled."""
+    global _default_cache
+    if not UPLOAD_CACHE_PATH:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = UploadCache()
+            except sqlite3.Error as e:
+                logging.error(f"Upload dedup cache unavailable at {UPLOAD_CACHE_PATH}: {e}")
+                return None
+        return _default_cache
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import derivatives
+import metrics
+import upload_cache
+
+
+# Upload settings using Environment Variables
+UPLOAD_MAX_WORKERS = int(os.getenv("UPLOAD_MAX_WORKERS", "16"))
+UPLOAD_MAX_CONCURRENCY_PER_REQUEST = int(os.getenv("UPLOAD_MAX_CONCURRENCY_PER_REQUEST", "5"))
+UPLOAD_TIMEOUT_SECONDS = float(os.getenv("UPLOAD_TIMEOUT_SECONDS", "60"))
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS, thread_name_prefix="image-upload")
+
+
+def cloudinary_upload(image_path):
+    """Upload image_path to Cloudinary using the process-wide cloudinary.config().
+
+    With EAGER_DERIVATIVES the comparison derivative is rendered in the background
+    straight away.
+    """
+    import cloudinary.uploader
+    return cloudinary.uploader.upload(image_path, timeout=UPLOAD_TIMEOUT_SECONDS, **derivatives.eager_options())
+
+
+class FakeCloudinary:
+    """Local stand-in for cloudinary.uploader.upload that copies files into a directory.
+
+    secure_url has Cloudinary's /image/upload/v<version>/<public_id> shape, so
+    derivative URLs can be built from it; the file is stored under public_id.
+    """
+
+    def __init__(self, directory, base_url="https://fake-cloudinary.local", latency_seconds=0.0):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+        self.latency_seconds = latency_seconds
+        self.uploads = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, image_path):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if hasattr(image_path, "read"):  # file object, as cloudinary.uploader.upload accepts
+            data = image_path.read()
+            image_path = getattr(image_path, "name", "")
+        else:
+            with open(image_path, "rb") as f:
+                data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        public_id = f"{digest[:20]}{os.path.splitext(image_path)[1]}"
+        with open(os.path.join(self.directory, public_id), "wb") as f:
+            f.write(data)
+        with self._lock:
+            self.uploads += 1
+        return {"public_id": public_id, "secure_url": f"{self.base_url}/image/upload/v1/{public_id}"}
+
+
+_backend = cloudinary_upload
+_cache = upload_cache.default_cache()
+
+
+def set_backend(upload):
+    """Replace the upload backend, e.g. with a FakeCloudinary for offline benchmarks."""
+    global _backend
+    _backend = upload
+
+
+def set_cache(cache):
+    """Replace the dedup cache consulted before every upload; None disables it."""
+    global _cache
+    _cache = cache
+
+
+def upload_image(image_path):
+    """Upload one image through the configured backend and return its secure URL.
+
+    Identical bytes that were uploaded before are answered from the dedup cache
+    without touching the network. image_path may also be an in-memory upload
+    (spool.SpooledImage), whose buffer and digest are used instead of re-reading a file.
+    """
+    cache = _cache
+    digest = None
+    if cache is not None:
+        digest = getattr(image_path, "digest", None) or upload_cache.file_digest(image_path)
+        cached_url = cache.get(digest)
+        if cached_url:
+            logging.info(f"Reusing previously uploaded image for {image_path}.")
+            return cached_url
+
+    with metrics.stage('upload'):
+        response = _backend(image_path.open() if hasattr(image_path, "open") else image_path)
+    secure_url = response.get("secure_url")
+    if not secure_url:
+        raise ValueError(f"Upload of {image_path} returned no secure_url")
+
+    if cache is not None:
+        cache.put(digest, secure_url)
+    return secure_url
+
+
+def upload_many(image_paths, upload=upload_image, max_concurrency=UPLOAD_MAX_CONCURRENCY_PER_REQUEST,
+                timeout=UPLOAD_TIMEOUT_SECONDS, fail_fast=True):
+    """Upload a {column: image_path} dict concurrently.
+
+    Returns (image_urls, errors), both keyed by column. An upload fails when upload()
+    raises, returns a falsy URL or is still running `timeout` seconds after it was
+    submitted. With fail_fast, no further uploads are started once one has failed;
+    uploads already in flight are allowed to finish. Uploads start in image_paths
+    order and errors keeps that order, so next(iter(errors)) is the column a serial
+    loop would have stopped at.
+    """
+    image_urls = {}
+    errors = {}
+    pending = list(image_paths.items())
+    in_flight = {}  # future -> (column, deadline)
+
+    while pending or in_flight:
+        while pending and len(in_flight) < max_concurrency and not (fail_fast and errors):
+            column, image_path = pending.pop(0)
+            future = _executor.submit(upload, image_path)
+            in_flight[future] = (column, time.monotonic() + timeout)
+
+        if not in_flight:
+            break
+
+        next_deadline = min(deadline for _, deadline in in_flight.values())
+        done, _ = wait(in_flight, timeout=max(0.0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            column, _ = in_flight.pop(future)
+            try:
+                image_url = future.result()
+            except Exception as e:
+                errors[column] = e
+                continue
+            if image_url:
+                image_urls[column] = image_url
+            else:
+                errors[column] = ValueError(f"Upload for {column} returned no URL")
+
+        now = time.monotonic()
+        for future, (column, deadline) in list(in_flight.items()):
+            if deadline <= now:
+                future.cancel()
+                del in_flight[future]
+                errors[column] = TimeoutError(f"Upload for {column} did not finish within {timeout}s")
+                logging.error(f"Upload for column '{column}' timed out after {timeout}s.")
+
+    ordered_errors = {column: errors[column] for column in image_paths if column in errors}
+    return image_urls, ordered_errors
@@ -0,0 +1,383 @@
+import logging
+
+import pyodbc
+from flask import url_for
+
+import compare_pool
+import db_pool
+import image_context
+import jobs
+import metrics
+import response_cache
+import schema
+import uploads
+
+
+# OpenCV and NumPy (scratch_pipeline, reference_store, inspection, diagnostics) are
+# imported inside the methods that compare images, so mounting an inspection blueprint
+# costs nothing until the first inspection request.
+
+
+def upload_image_to_cloudinary(image_path):
+    """Upload image to Cloudinary and return the secure URL."""
+    try:
+        return uploads.upload_image(image_path)
+    except Exception as e:
+        logging.error(f"Error uploading image to Cloudinary: {e}")
+        return None
+
+
+def needs_detection(new_image_path, row):
+    """Return True when there is both a new image and a stored image to compare."""
+    return bool(row['image_url']) and image_context.image_exists(new_image_path)
+
+
+def job_accepted(job_id):
+    """202 response pointing the client at the job's status endpoint of the current blueprint."""
+    status_url = url_for('.job_status', job_id=job_id)
+    return {'job_id': job_id, 'status': jobs.QUEUED, 'status_url': status_url}, 202, {'Location': status_url}
+
+
+class VehicleInspection:
+    """Scratch inspection of the rows of one catalog table.
+
+    spec is catalog.CARS or catalog.SCOOTERS and profile_name the matching
+    scratch_pipeline profile ('car' or 'scooter'), which also names the service in
+    metrics and the inspection's job kinds. New photos are compared against the
+    stored image of every row with the same segment_id and model_type; columns where
+    a difference is found are uploaded and their new URLs written back.
+    """
+
+    def __init__(self, spec, profile_name, db_config):
+        self.spec = spec
+        self.name = profile_name
+        self.db_config = db_config
+        # Background jobs for clients that cannot hold a request open for a whole segment
+        self.job_queue = jobs.JobQueue({
+            f'{profile_name}_segment': lambda payload: self.update_images_for_segment(payload['segment_id'], payload['model_type'], payload['image_paths']),
+            f'{profile_name}_batch': lambda payload: self.update_images_for_segments(payload['vehicles']),
+        }, retry_on=(compare_pool.PoolSaturated,))
+
+    def profile(self):
+        """The scratch_pipeline profile dict; OpenCV is only imported once something is compared."""
+        import scratch_pipeline
+        return scratch_pipeline.PROFILES[self.name]
+
+    def retrieve_image_urls_from_db(self, segment_id, model_type, columns):
+        """Retrieve every requested image column for the rows matching segment_id and model_type in one query."""
+        columns = schema.image_columns(columns)
+        if not columns:
+            return []
+        id_column = self.spec['id']
+        try:
+            with db_pool.get_pool(self.db_config).connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    query = f"""
+                        SELECT {id_column}, segment_id, segment_name, model_type, {', '.join(columns)}
+                        FROM {self.spec['table']}
+                        WHERE model_type = ? AND segment_id = ?
+                    """
+                    with metrics.stage('db_query'):
+                        cursor.execute(query, (model_type, segment_id))
+                        results = cursor.fetchall()
+                finally:
+                    cursor.close()
+        except (pyodbc.Error, db_pool.PoolTimeout) as e:
+            logging.error(f"Error retrieving image URLs for segment_id '{segment_id}' and model_type '{model_type}': {e}")
+            return []
+
+        if not results:
+            logging.warning(f"No {self.spec['table']} rows found for model_type '{model_type}' and segment_id '{segment_id}'.")
+            return []
+        logging.info(f"Successfully retrieved image URLs for segment_id '{segment_id}' and model_type '{model_type}'.")
+        return [
+            {
+                id_column: row[0],
+                'segment_id': row[1],
+                'segment_name': row[2],
+                'model_type': row[3],
+                'image_urls': dict(zip(columns, row[4:]))  # column -> image URL
+            }
+            for row in results
+        ]
+
+    def row_for_column(self, row, column):
+        """Single-column view of a row from retrieve_image_urls_from_db."""
+        return {
+            self.spec['id']: row[self.spec['id']],
+            'segment_id': row['segment_id'],
+            'segment_name': row['segment_name'],
+            'model_type': row['model_type'],
+            'image_url': row['image_urls'][column]
+        }
+
+    def detect_scratches_or_differences(self, new_image_path, existing_image_url, row_id=None, column=None):
+        """Detect scratches or differences between a new photo and a stored image.
+
+        Returns the outcome dict from scratch_pipeline.compare_tiered, including which tier decided.
+        """
+        import diagnostics
+        import reference_store
+        import scratch_pipeline
+        profile = self.profile()
+        try:
+            # Pairs whose frames match before enhancement are settled without enhancing
+            # the new photo or queueing a comparison
+            signatures = None
+            if profile['signature_tolerance'] is not None:
+                signatures = (
+                    scratch_pipeline.load_new_signature(new_image_path, profile),
+                    reference_store.load_signature(existing_image_url, profile, row_id, column),
+                )
+                settled = scratch_pipeline.settle_on_signatures(signatures, profile)
+                if settled is not None:
+                    logging.info("No significant scratches or differences detected (decided by the signature tier).")
+                    return settled
+
+            new_image = scratch_pipeline.load_new_image(new_image_path, profile)
+            if new_image is None:
+                logging.error("Failed to load the new image.")
+                return scratch_pipeline.failed_outcome(False)
+
+            # Precomputed once per stored image when row_id and column identify it
+            existing_image = reference_store.load_reference(existing_image_url, profile, row_id, column)
+            if existing_image is None:
+                logging.error("Failed to load the existing image from Cloudinary.")
+                return scratch_pipeline.failed_outcome(True)
+
+            # Runs in the comparison process pool so the request thread is not tied up by OpenCV
+            capture = diagnostics.should_capture()
+            outcome = compare_pool.default_pool().compare(new_image, existing_image, profile, capture_stages=capture,
+                                                          signatures=signatures)
+            if capture:
+                outcome, stages = outcome
+                if stages:
+                    diagnostics.record(f"{self.name}_{row_id}_{column}", stages)
+
+            if outcome['scratch_detected']:
+                logging.info(f"Scratches or differences detected between the images (decided by the {outcome['tier']} tier).")
+            else:
+                logging.info(f"No significant scratches or differences detected (decided by the {outcome['tier']} tier).")
+            return outcome
+
+        except compare_pool.PoolSaturated:
+            raise
+        except scratch_pipeline.ImageTooLarge as e:
+            logging.error(f"Refusing to compare {new_image_path}: {e}")
+            return scratch_pipeline.too_large_outcome()
+        except Exception as e:
+            logging.error(f"Error detecting scratches or differences in images: {e}")
+            return scratch_pipeline.error_outcome()
+
+    def write_image_urls(self, updates):
+        """Apply [(segment_id, model_type, {column: new_image_url})] in one transaction and return each UPDATE's affected row count.
+
+        Every group gets a single UPDATE setting all of its changed columns at once, and
+        nothing is committed unless every statement succeeds.
+        """
+        table = self.spec['table']
+        rowcounts = []
+        with db_pool.get_pool(self.db_config).connection() as conn:
+            cursor = conn.cursor()
+            try:
+                with metrics.stage('db_update'):
+                    for segment_id, model_type, new_image_urls in updates:
+                        columns = schema.image_columns(new_image_urls)
+                        if not columns:
+                            rowcounts.append(0)
+                            continue
+                        cursor.execute(f"""
+                            UPDATE {table}
+                            SET {', '.join(f'{column} = ?' for column in columns)}
+                            WHERE segment_id = ? AND model_type = ?
+                        """, [new_image_urls[column] for column in columns] + [segment_id, model_type])
+                        rowcounts.append(cursor.rowcount)
+                    conn.commit()
+                # Listing pages of the segments whose image URLs changed are now stale
+                response_cache.invalidate(table, [
+                    segment_id for (segment_id, _, _), rowcount in zip(updates, rowcounts) if rowcount
+                ])
+                return rowcounts
+            finally:
+                cursor.close()
+
+    def refresh_references(self, new_image_url, row_ids, column):
+        """Precompute the comparison reference for the image that just replaced column on these rows."""
+        import reference_store
+        try:
+            reference_store.store_new_reference(new_image_url, self.profile(), row_ids, column)
+        except Exception as e:
+            logging.warning(f"Could not precompute reference for column '{column}': {e}")
+
+    def find_comparisons(self, segment_id, model_type, image_paths):
+        """Look up the rows to compare against for every image column.
+
+        Returns (column, new_image_path, row) triples in request order and, per column,
+        the ids of the rows an UPDATE of that column would touch.
+        """
+        comparisons = []
+        row_ids = {}
+
+        columns = [column for column in image_paths if column in schema.IMAGE_COLUMNS]
+        for column in image_paths:
+            if column not in schema.IMAGE_COLUMNS:
+                logging.warning(f"Ignoring unknown image column '{column}'.")
+
+        # One round trip for every requested view, fanned out per column below
+        rows = self.retrieve_image_urls_from_db(segment_id, model_type, columns)
+        if not rows:
+            return comparisons, row_ids
+
+        for column in columns:
+            logging.info(f"Processing image for column '{column}' (Segment: {segment_id}, Model: {model_type}).")
+            row_ids[column] = [row[self.spec['id']] for row in rows]
+            comparisons.extend((column, image_paths[column], self.row_for_column(row, column)) for row in rows)
+        return comparisons, row_ids
+
+    def stage_comparisons(self, segment_id, model_type, image_paths, comparisons, detections):
+        """Build per-image results from detection outcomes and upload the replacement images.
+
+        Returns (result, replacements, new_image_urls); the database is not touched, so
+        several segments can be staged and then written together by apply_staged.
+        """
+        result = []  # Collect results for each image
+        replacements = []  # (index into result, column) for images that must be uploaded
+
+        for (column, new_image_path, row), detection in zip(comparisons, detections):
+            if not image_context.image_exists(new_image_path):
+                logging.error(f"New image file not found: {new_image_path}")
+                result.append({'column': column, 'status': 'Error: File not found'})
+                continue
+
+            if not row['image_url']:
+                logging.warning(f"No existing image URL found for column '{column}', segment_id '{segment_id}', model_type '{model_type}'.")
+                result.append({'column': column, 'status': 'No existing image URL'})
+                continue
+
+            metrics.record_outcome(self.name, detection)
+            if 'error' in detection:
+                result.append({'column': column, 'status': detection['error'], 'decided_by': detection['tier']})
+            elif detection['scratch_detected']:
+                logging.info(f"Scratches or differences detected for column '{column}', segment_id '{segment_id}', model_type '{model_type}'. Uploading new image.")
+                replacements.append((len(result), column))
+                result.append({'column': column, 'decided_by': detection['tier']})
+            else:
+                logging.info(f"No scratches or differences detected for column '{column}', segment_id '{segment_id}', model_type '{model_type}'. Keeping existing image.")
+                result.append({'column': column, 'status': 'No scratches detected, image retained', 'decided_by': detection['tier']})
+
+        # Upload each replacement image once, with every column in flight at the same time
+        to_upload = {column: image_paths[column] for _, column in replacements}
+        new_image_urls, _ = uploads.upload_many(to_upload, upload=upload_image_to_cloudinary, fail_fast=False)
+        return result, replacements, new_image_urls
+
+    def finish_comparisons(self, segment_id, model_type, row_ids, staged, rowcount, error=None):
+        """Fill in the statuses of a staged segment once its UPDATE has run (or failed with error)."""
+        result, replacements, new_image_urls = staged
+
+        refreshed_columns = set()
+        for index, column in replacements:
+            new_image_url = new_image_urls.get(column)
+            if not new_image_url:
+                result[index]['status'] = f'Failed to upload image for {column}'
+            elif error is not None:
+                logging.error(f"Database error while updating column '{column}': {error}")
+                result[index]['status'] = f'Error: {str(error)}'
+            elif rowcount > 0:
+                logging.info(f"Successfully updated image URL for column '{column}', segment_id '{segment_id}', model_type '{model_type}'.")
+                result[index].update({'status': 'Scratches detected, image updated', 'new_image_url': new_image_url, 'rows_updated': rowcount})
+                if column not in refreshed_columns:
+                    self.refresh_references(new_image_url, row_ids[column], column)
+                    refreshed_columns.add(column)
+            else:
+                logging.warning(f"No rows updated for column '{column}', segment_id '{segment_id}', model_type '{model_type}'.")
+                result[index]['status'] = 'No update made'
+
+        return result
+
+    def apply_staged(self, segments):
+        """Write the new image URLs of every staged segment in one transaction and return their results.
+
+        segments holds (segment_id, model_type, row_ids, staged) tuples.
+        """
+        updates = [(segment_id, model_type, staged[2]) for segment_id, model_type, _, staged in segments]
+        rowcounts = [0] * len(segments)
+        error = None
+        if any(new_image_urls for _, _, new_image_urls in updates):
+            try:
+                rowcounts = self.write_image_urls(updates)
+            except (pyodbc.Error, db_pool.PoolTimeout) as e:
+                error = e
+
+        return [
+            self.finish_comparisons(segment_id, model_type, row_ids, staged, rowcount, error)
+            for (segment_id, model_type, row_ids, staged), rowcount in zip(segments, rowcounts)
+        ]
+
+    def update_images_for_segment(self, segment_id, model_type, image_paths):
+        """Compare new photos against every row matching model_type and segment_id, replacing the images that differ."""
+        import reference_store
+        # Read every photo once; each is then decoded and prepared once for all matching rows
+        image_paths = image_context.load_images(image_paths)
+        comparisons, row_ids = self.find_comparisons(segment_id, model_type, image_paths)
+        id_column = self.spec['id']
+        # Download every stored image this request compares against concurrently, up front
+        reference_store.prefetch([
+            row['image_url'] for _, new_image_path, row in comparisons if needs_detection(new_image_path, row)
+        ], self.profile())
+        detections = [
+            self.detect_scratches_or_differences(new_image_path, row['image_url'], row[id_column], column)
+            if needs_detection(new_image_path, row) else None
+            for column, new_image_path, row in comparisons
+        ]
+        staged = self.stage_comparisons(segment_id, model_type, image_paths, comparisons, detections)
+        return self.apply_staged([(segment_id, model_type, row_ids, staged)])[0]
+
+    def update_images_for_segments(self, vehicles):
+        """Batch form of update_images_for_segment: compare every vehicle's images in stacked passes."""
+        import inspection
+        loaded = {}  # a photo shared by several vehicles is still read once
+        vehicles = [dict(vehicle, image_paths=image_context.load_images(vehicle['image_paths'], loaded)) for vehicle in vehicles]
+        id_column = self.spec['id']
+        lookups = []
+        pairs = []
+        for vehicle in vehicles:
+            comparisons, row_ids = self.find_comparisons(vehicle['segment_id'], vehicle['model_type'], vehicle['image_paths'])
+            flags = [needs_detection(new_image_path, row) for _, new_image_path, row in comparisons]
+            lookups.append((comparisons, row_ids, flags))
+            pairs.extend(
+                (new_image_path, row['image_url'], row[id_column], column)
+                for (column, new_image_path, row), flag in zip(comparisons, flags)
+                if flag
+            )
+
+        outcomes = iter(inspection.detect_batch(pairs, self.profile()))
+
+        segments = []
+        for vehicle, (comparisons, row_ids, flags) in zip(vehicles, lookups):
+            detections = [next(outcomes) if flag else None for flag in flags]
+            staged = self.stage_comparisons(vehicle['segment_id'], vehicle['model_type'], vehicle['image_paths'], comparisons, detections)
+            segments.append((vehicle['segment_id'], vehicle['model_type'], row_ids, staged))
+
+        # Every vehicle's replacements are written in a single transaction
+        return [
+            {'segment_id': vehicle['segment_id'], 'model_type': vehicle['model_type'], 'results': results}
+            for vehicle, results in zip(vehicles, self.apply_staged(segments))
+        ]
+
+    def submit_segment(self, payload):
+        """Queue update_images_for_segment for a {segment_id, model_type, image_paths} payload; returns the job id."""
+        return self.job_queue.submit(f'{self.name}_segment', payload)
+
+    def submit_batch(self, vehicles):
+        """Queue update_images_for_segments for vehicles; returns the job id."""
+        return self.job_queue.submit(f'{self.name}_batch', {'vehicles': vehicles})
+
+    def start_workers(self):
+        """Fork the comparison workers, then resume jobs a previous run left unfinished.
+
+        Called when the blueprint is registered: the workers must be forked while this
+        process has no job or download threads running, so never from a request.
+        """
+        compare_pool.start()
+        self.job_queue.start()